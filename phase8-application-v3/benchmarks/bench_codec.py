@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark codec cho message body Phase 8: json (stdlib) vs orjson vs msgpack.
+So sánh CPU encode/decode và số bytes cho message điển hình:
+  - admin/users: response list 100 users (body lớn nhất đi qua queue)
+  - transfer: request payload producer → transfer.requests và response
+
+Dùng (từ phase8-application-v3/):
+  python benchmarks/bench_codec.py
+  python benchmarks/bench_codec.py --users 500 --number 2000
+
+Cài đặt:
+  pip install -r common/requirements.txt
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.rabbitmq_utils import JsonCodec, MsgpackCodec, OrjsonCodec, msgpack, orjson  # noqa: E402
+
+
+def admin_users_message(n: int) -> dict:
+    users = [
+        {"id": 100000 - i, "phone": f"09{10000000 + i:08d}", "username": f"Nguyễn Văn An {i}", "account_number": f"{123456789012 + i * 7919}", "balance": 100000 + i * 37}
+        for i in range(n)
+    ]
+    return {"status": 200, "body": {"users": users, "total": 100000, "page": 1, "size": n, "pages": 100000 // n}}
+
+
+def transfer_request_message() -> dict:
+    return {
+        "action": "transfer",
+        "path": "/api/transfer/transfer",
+        "method": "POST",
+        "payload": {"to_account_number": "123456789012", "amount": 5000},
+        "headers": {"x-session": "3f2b9c1e8d7a4b6c9e0f1a2b3c4d5e6f", "x-admin-secret": ""},
+        "correlation_id": "2b7f3c9e-1d4a-4e8b-9f6a-0c1d2e3f4a5b",
+        "reply_to": "reply:5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b",
+    }
+
+
+def transfer_response_message() -> dict:
+    return {"status": 200, "body": {"ok": True, "from": "Trần Thị Bình 42", "to": "Lê Minh Chi 7", "to_account_number": "123456789012", "amount": 5000}}
+
+
+def bench(codec, message: dict, number: int) -> tuple[int, float, float]:
+    data = codec.encode(message)
+    enc = min(timeit.repeat(lambda: codec.encode(message), number=number, repeat=5)) / number
+    dec = min(timeit.repeat(lambda: codec.decode(data), number=number, repeat=5)) / number
+    return len(data), enc * 1e6, dec * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message codecs (json / orjson / msgpack)")
+    parser.add_argument("--users", type=int, default=100, help="Số users trong response admin/users (default: 100)")
+    parser.add_argument("--number", "-n", type=int, default=1000, help="Số lần encode/decode mỗi lượt đo (default: 1000)")
+    args = parser.parse_args()
+
+    codecs = [JsonCodec()]
+    if orjson:
+        codecs.append(OrjsonCodec())
+    else:
+        print("  (orjson chưa cài — bỏ qua)")
+    if msgpack:
+        codecs.append(MsgpackCodec())
+    else:
+        print("  (msgpack chưa cài — bỏ qua)")
+
+    messages = [
+        (f"admin/users response ({args.users} users)", admin_users_message(args.users)),
+        ("transfer request", transfer_request_message()),
+        ("transfer response", transfer_response_message()),
+    ]
+
+    print("=" * 72)
+    print(f"  {'message':<34s} {'codec':<8s} {'bytes':>8s} {'encode µs':>10s} {'decode µs':>10s}")
+    print("=" * 72)
+    for label, message in messages:
+        baseline = None
+        for codec in codecs:
+            size, enc_us, dec_us = bench(codec, message, args.number)
+            if baseline is None:
+                baseline = (size, enc_us, dec_us)
+                note = ""
+            else:
+                note = f"  ({enc_us / baseline[1]:.2f}x enc, {dec_us / baseline[2]:.2f}x dec, {size / baseline[0]:.2f}x bytes)"
+            print(f"  {label:<34s} {codec.name:<8s} {size:>8,d} {enc_us:>10.2f} {dec_us:>10.2f}{note}")
+        print("-" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Tra cứu account_number → username cho account-service lookup (UI gọi theo từng phím khi nhập số tài khoản):
+1. LRU trong process có TTL (LOOKUP_LOCAL_*) — không round trip.
+2. 1 pipeline Redis: cache `lookup:{account_number}` (username, hoặc "null" = không tồn tại — negative cache TTL
+   ngắn) + Bloom filter số tài khoản hợp lệ. Bloom nói "chắc chắn không có" → 404 không chạm DB (gõ nhầm, dò số).
+3. DB (index unique account_number), ghi lại cả 2 tầng cache.
+Bloom: bitmap Redis (SETBIT/GETBIT trong Lua), m bit / k hash từ ACCOUNT_BLOOM_CAPACITY + ACCOUNT_BLOOM_ERROR_RATE —
+tên key chứa m, k nên đổi tham số = key mới. auth-service thêm số mới khi register; account-service rebuild lúc
+startup và mỗi ACCOUNT_BLOOM_REBUILD_INTERVAL_SECONDS (bù add bị lỡ khi Redis lỗi). Filter chưa build xong → bỏ qua
+Bloom (không false negative). Redis lỗi → đi thẳng DB.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.db import AsyncSessionLocal
+from common.models import User
+from common.observability import get_counter
+
+LOOKUP_LOCAL_CACHE_SIZE = int(os.getenv("LOOKUP_LOCAL_CACHE_SIZE", "10000"))
+LOOKUP_LOCAL_TTL_SECONDS = float(os.getenv("LOOKUP_LOCAL_TTL_SECONDS", "30"))
+LOOKUP_CACHE_TTL_SECONDS = int(os.getenv("LOOKUP_CACHE_TTL_SECONDS", "600"))
+# Negative: số vừa register có thể đang bị cache "không tồn tại" ở replica khác tới hết TTL này
+LOOKUP_NEGATIVE_TTL_SECONDS = int(os.getenv("LOOKUP_NEGATIVE_TTL_SECONDS", "10"))
+ACCOUNT_BLOOM_CAPACITY = int(os.getenv("ACCOUNT_BLOOM_CAPACITY", "1000000"))
+ACCOUNT_BLOOM_ERROR_RATE = float(os.getenv("ACCOUNT_BLOOM_ERROR_RATE", "0.001"))
+ACCOUNT_BLOOM_REBUILD_INTERVAL_SECONDS = int(os.getenv("ACCOUNT_BLOOM_REBUILD_INTERVAL_SECONDS", "3600"))
+REBUILD_CHUNK = 5000
+
+_MISS = object()
+
+
+class TTLCache:
+    """LRU có TTL từng entry (OrderedDict) — không lock: chỉ dùng trong 1 event loop."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        """Giá trị (None hợp lệ = negative) hoặc _MISS nếu không có / hết hạn."""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISS
+        if entry[0] < time.monotonic():
+            del self._data[key]
+            return _MISS
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+# KEYS = filter đang dùng + filter đang rebuild; ARGV = vị trí bit. Chỉ ghi key đã tồn tại: tạo key live từ 1 add
+# lẻ sẽ làm reader tưởng filter đã build → false negative cho mọi số khác.
+_ADD_LUA = """
+for _, key in ipairs(KEYS) do
+  if redis.call('EXISTS', key) == 1 then
+    for i = 1, #ARGV do redis.call('SETBIT', key, ARGV[i], 1) end
+  end
+end
+return 0
+"""
+# 1 = có thể tồn tại (hoặc filter chưa build), 0 = chắc chắn không
+_CHECK_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 1 end
+for i = 1, #ARGV do
+  if redis.call('GETBIT', KEYS[1], ARGV[i]) == 0 then return 0 end
+end
+return 1
+"""
+
+
+class BloomFilter:
+    """Bloom filter trên bitmap Redis; vị trí bit = double hashing blake2b (ổn định giữa process, khác hash())."""
+
+    def __init__(self, name: str, capacity: int, error_rate: float):
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.key = f"bloom:{name}:{self.bits}:{self.hashes}"
+        self.building_key = f"{self.key}:building"
+        self.lock_key = f"{self.key}:rebuild_lock"
+        self._add_script = None
+        self._check_script = None
+
+    def positions(self, value: str) -> list[int]:
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    async def add(self, redis: Redis, value: str) -> None:
+        if self._add_script is None:
+            self._add_script = redis.register_script(_ADD_LUA)
+        await self._add_script(keys=[self.key, self.building_key], args=self.positions(value), client=redis)
+
+    def check(self, redis, value: str):
+        """Coroutine (hoặc lệnh trong pipeline nếu redis là pipeline) — kết quả 1/0, xem _CHECK_LUA."""
+        if self._check_script is None:
+            self._check_script = redis.register_script(_CHECK_LUA)
+        return self._check_script(keys=[self.key], args=self.positions(value), client=redis)
+
+    async def rebuild(self, redis: Redis, db: AsyncSession) -> int | None:
+        """
+        Build lại từ users: tạo key building trước (add song song ghi vào cả key này), dựng bitmap trong process
+        từ 1 lần scan account_number, OR vào key building rồi RENAME thành key live (reader không thấy filter dở).
+        Lock Redis: 1 replica rebuild. Trả số account, None nếu replica khác đang rebuild.
+        """
+        token = uuid.uuid4().hex
+        if not await redis.set(self.lock_key, token, nx=True, ex=600):
+            return None
+        try:
+            await redis.delete(self.building_key)
+            await redis.setbit(self.building_key, 0, 0)
+            bitmap = bytearray((self.bits + 7) // 8)
+            count = 0
+            result = await db.stream_scalars(select(User.account_number).execution_options(yield_per=REBUILD_CHUNK))
+            async for account_number in result:
+                for pos in self.positions(account_number):
+                    bitmap[pos >> 3] |= 0x80 >> (pos & 7)  # bit 0 của Redis = MSB byte đầu
+                count += 1
+            scratch = f"{self.key}:scratch:{token}"
+            await redis.set(scratch, bytes(bitmap), ex=600)
+            await redis.bitop("OR", self.building_key, self.building_key, scratch)
+            await redis.delete(scratch)
+            await redis.rename(self.building_key, self.key)
+            return count
+        finally:
+            if await redis.get(self.lock_key) == token:
+                await redis.delete(self.lock_key)
+
+
+ACCOUNT_BLOOM = BloomFilter("account_numbers", ACCOUNT_BLOOM_CAPACITY, ACCOUNT_BLOOM_ERROR_RATE)
+_local = TTLCache(LOOKUP_LOCAL_CACHE_SIZE)
+
+
+def _cache_key(account_number: str) -> str:
+    return f"lookup:{account_number}"
+
+
+async def lookup_username(redis: Redis, account_number: str) -> str | None:
+    """username của account_number, None nếu không tồn tại. Metric account_lookup_total{result}."""
+    results = get_counter("account_lookup_total", "Account number lookups by where they were answered", ("result",))
+    cached = _local.get(account_number)
+    if cached is not _MISS:
+        results.labels(result="local_hit").inc()
+        return cached
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(_cache_key(account_number))
+            await ACCOUNT_BLOOM.check(pipe, account_number)
+            raw, maybe = await pipe.execute()
+    except RedisError:
+        raw, maybe = None, 1
+    if raw is not None:
+        username = json.loads(raw)
+        _local.set(account_number, username, LOOKUP_LOCAL_TTL_SECONDS if username is not None else min(LOOKUP_LOCAL_TTL_SECONDS, LOOKUP_NEGATIVE_TTL_SECONDS))
+        results.labels(result="redis_hit").inc()
+        return username
+    if not maybe:
+        _local.set(account_number, None, min(LOOKUP_LOCAL_TTL_SECONDS, LOOKUP_NEGATIVE_TTL_SECONDS))
+        results.labels(result="bloom_reject").inc()
+        return None
+    async with AsyncSessionLocal() as db:
+        username = (await db.execute(select(User.username).where(User.account_number == account_number))).scalar_one_or_none()
+    ttl = LOOKUP_CACHE_TTL_SECONDS if username is not None else LOOKUP_NEGATIVE_TTL_SECONDS
+    _local.set(account_number, username, min(LOOKUP_LOCAL_TTL_SECONDS, ttl))
+    try:
+        await redis.setex(_cache_key(account_number), ttl, json.dumps(username))
+    except RedisError:
+        pass
+    results.labels(result="db_found" if username is not None else "db_missing").inc()
+    return username
+
+
+async def register_account(redis: Redis, account_number: str) -> None:
+    """Sau khi register commit: thêm vào Bloom + xoá negative cache Redis (số có thể đã bị tra trước đó)."""
+    await ACCOUNT_BLOOM.add(redis, account_number)
+    await redis.delete(_cache_key(account_number))
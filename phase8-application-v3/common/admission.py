@@ -0,0 +1,189 @@
+"""
+Admission control / load shedding cho API Producer.
+QueueMonitor lấy mẫu depth + consumer count của từng request queue (passive declare_queue) định kỳ;
+AdmissionController từ chối sớm (503 + Retry-After) thay vì để request chờ đến timeout khi consumers tụt lại.
+"""
+import asyncio
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import aio_pika
+
+from common.rabbitmq_utils import REQUEST_QUEUES
+
+if TYPE_CHECKING:
+    from logging import Logger
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() in ("true", "1", "yes")
+SAMPLE_INTERVAL = float(os.getenv("ADMISSION_SAMPLE_INTERVAL_SECONDS", "2"))
+# Ngưỡng mặc định cho mọi queue; 0 = không giới hạn
+DEFAULT_MAX_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "1000"))
+DEFAULT_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "0"))
+# Override theo queue: "transfer.requests=500:200,account.requests=2000" (max_depth[:max_inflight])
+QUEUE_LIMITS = os.getenv("ADMISSION_QUEUE_LIMITS", "")
+# Mặc định tắt: rolling restart có lúc consumer count = 0 trong vài giây — broker vẫn buffer message (durable queue)
+# cho consumer mới. Bật thì chỉ từ chối khi NO_CONSUMERS_SAMPLES mẫu liên tiếp đều = 0 (≈ samples × interval giây)
+REJECT_NO_CONSUMERS = os.getenv("ADMISSION_REJECT_NO_CONSUMERS", "false").lower() in ("true", "1", "yes")
+NO_CONSUMERS_SAMPLES = max(1, int(os.getenv("ADMISSION_NO_CONSUMERS_SAMPLES", "3")))
+RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+RETRY_AFTER_MAX_SECONDS = 30
+
+
+@dataclass
+class QueueLimit:
+    max_depth: int = DEFAULT_MAX_DEPTH
+    max_inflight: int = DEFAULT_MAX_INFLIGHT
+
+
+@dataclass
+class QueueSample:
+    depth: int
+    consumers: int
+    sampled_at: float
+    drain_rate: float = 0.0  # message/s ước lượng từ 2 lần lấy mẫu liên tiếp
+    zero_consumer_samples: int = 0  # số mẫu liên tiếp (tính cả mẫu này) không có consumer
+
+
+@dataclass
+class Rejection:
+    reason: str
+    retry_after: int
+
+
+def parse_queue_limits(spec: str = QUEUE_LIMITS) -> dict[str, QueueLimit]:
+    limits: dict[str, QueueLimit] = {}
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        name, _, values = item.partition("=")
+        depth, _, inflight = values.partition(":")
+        limits[name.strip()] = QueueLimit(
+            max_depth=int(depth) if depth else DEFAULT_MAX_DEPTH,
+            max_inflight=int(inflight) if inflight else DEFAULT_MAX_INFLIGHT,
+        )
+    return limits
+
+
+class QueueMonitor:
+    """Lấy mẫu message_count / consumer_count của từng queue bằng passive declare (không tạo queue)."""
+
+    def __init__(self, connection: aio_pika.abc.AbstractConnection, queue_names: tuple[str, ...] = REQUEST_QUEUES, interval: float = SAMPLE_INTERVAL, logger: "Logger | None" = None):
+        from common.observability import get_gauge
+
+        self.connection = connection
+        self.queue_names = queue_names
+        self.interval = interval
+        self.logger = logger
+        self.samples: dict[str, QueueSample] = {}
+        self._task: asyncio.Task | None = None
+        self._depth = get_gauge("rmq_queue_depth", "Messages ready in request queue (sampled by producer)", ("queue",))
+        self._consumers = get_gauge("rmq_queue_consumers", "Consumers attached to request queue (sampled by producer)", ("queue",))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def sample(self, queue_name: str) -> QueueSample | None:
+        """Mẫu gần nhất; None nếu chưa có hoặc đã cũ (monitor lỗi) → fail open."""
+        s = self.samples.get(queue_name)
+        if s is None or time.monotonic() - s.sampled_at > self.interval * 3:
+            return None
+        return s
+
+    async def _run(self) -> None:
+        from common.logging_utils import log_error_event
+
+        channel = None
+        while True:
+            try:
+                if channel is None or channel.is_closed:
+                    channel = await self.connection.channel()
+                for name in self.queue_names:
+                    queue = await channel.declare_queue(name, passive=True)
+                    result = queue.declaration_result
+                    self._record(name, result.message_count, result.consumer_count)
+            except asyncio.CancelledError:
+                if channel is not None and not channel.is_closed:
+                    await channel.close()
+                raise
+            except Exception as e:
+                # Passive declare lỗi (queue chưa có) đóng channel — vòng sau mở lại
+                channel = None
+                if self.logger:
+                    log_error_event(self.logger, "queue_monitor_error", exc=e)
+            await asyncio.sleep(self.interval)
+
+    def _record(self, name: str, depth: int, consumers: int) -> None:
+        now = time.monotonic()
+        prev = self.samples.get(name)
+        drain_rate = prev.drain_rate if prev else 0.0
+        if prev and now > prev.sampled_at and depth < prev.depth:
+            drain_rate = (prev.depth - depth) / (now - prev.sampled_at)
+        zero_streak = (prev.zero_consumer_samples if prev else 0) + 1 if consumers == 0 else 0
+        self.samples[name] = QueueSample(depth=depth, consumers=consumers, sampled_at=now, drain_rate=drain_rate, zero_consumer_samples=zero_streak)
+        self._depth.labels(queue=name).set(depth)
+        self._consumers.labels(queue=name).set(consumers)
+
+
+class AdmissionController:
+    """
+    Quyết định nhận/từ chối request theo queue:
+    - no_consumers: queue không có consumer nào trong ADMISSION_NO_CONSUMERS_SAMPLES mẫu liên tiếp
+      (khi ADMISSION_REJECT_NO_CONSUMERS — mặc định tắt)
+    - queue_depth: depth vượt max_depth
+    - inflight: số request producer này đang chờ trên queue vượt max_inflight
+    Metric producer_admission_total{queue, decision} cho KEDA/alerting.
+    """
+
+    def __init__(self, monitor: QueueMonitor, limits: dict[str, QueueLimit] | None = None):
+        from common.observability import get_counter, get_gauge
+
+        self.monitor = monitor
+        self.limits = limits if limits is not None else parse_queue_limits()
+        self._inflight: dict[str, int] = {}
+        self._decisions = get_counter("producer_admission_total", "Producer admission decisions per queue", ("queue", "decision"))
+        self._inflight_gauge = get_gauge("producer_inflight_requests", "Requests waiting for a consumer response, per queue", ("queue",))
+
+    def _limit(self, queue_name: str) -> QueueLimit:
+        return self.limits.get(queue_name) or QueueLimit()
+
+    def _retry_after(self, sample: QueueSample | None, excess: int) -> int:
+        if sample and sample.drain_rate > 0:
+            return max(1, min(RETRY_AFTER_MAX_SECONDS, math.ceil(excess / sample.drain_rate)))
+        return RETRY_AFTER_SECONDS
+
+    def try_admit(self, queue_name: str) -> Rejection | None:
+        """None = nhận (phải gọi release sau khi xong); Rejection = trả 503."""
+        limit = self._limit(queue_name)
+        sample = self.monitor.sample(queue_name)
+        rejection = None
+        if sample is not None:
+            if REJECT_NO_CONSUMERS and sample.zero_consumer_samples >= NO_CONSUMERS_SAMPLES:
+                rejection = Rejection("no_consumers", RETRY_AFTER_SECONDS)
+            elif limit.max_depth and sample.depth >= limit.max_depth:
+                rejection = Rejection("queue_depth", self._retry_after(sample, sample.depth - limit.max_depth + 1))
+        inflight = self._inflight.get(queue_name, 0)
+        if rejection is None and limit.max_inflight and inflight >= limit.max_inflight:
+            rejection = Rejection("inflight", RETRY_AFTER_SECONDS)
+        if rejection:
+            self._decisions.labels(queue=queue_name, decision=f"shed_{rejection.reason}").inc()
+            return rejection
+        self._inflight[queue_name] = inflight + 1
+        self._inflight_gauge.labels(queue=queue_name).set(inflight + 1)
+        self._decisions.labels(queue=queue_name, decision="admitted").inc()
+        return None
+
+    def release(self, queue_name: str) -> None:
+        inflight = max(0, self._inflight.get(queue_name, 0) - 1)
+        self._inflight[queue_name] = inflight
+        self._inflight_gauge.labels(queue=queue_name).set(inflight)
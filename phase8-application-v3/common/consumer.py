@@ -0,0 +1,344 @@
+"""
+Consumer framework cho Phase 8 — dùng chung cho auth, account, transfer, notification.
+- Router: handler đăng ký bằng decorator theo path template ("admin/users/{user_id}") hoặc action;
+  dispatch O(1) bằng dict lookup, path param parse 1 lần.
+- Middleware: reply (store_response), deadline, tracing, request-flow log, metrics, error → 500.
+- Consumer: kết nối RabbitMQ, decode message, chạy chain, trả response (decode lỗi → 400/500, không để producer chờ).
+  Prefetch / concurrency đọc từ env theo queue (consumer_setting); in-flight bị giới hạn bằng semaphore.
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+import aio_pika
+from fastapi import HTTPException
+from redis.asyncio import Redis
+
+from common.logging_utils import log_event, log_error_event, should_log_request_flow
+from common.observability import get_counter, get_gauge, get_histogram, get_tracer
+from common.rabbitmq_utils import RABBITMQ_URL, decode_message, is_expired, record_expired, store_response
+
+if TYPE_CHECKING:
+    from logging import Logger
+
+
+def consumer_setting(name: str, queue_name: str, default: int) -> int:
+    """
+    Đọc CONSUMER_<NAME>_<QUEUE> (VD CONSUMER_PREFETCH_TRANSFER_REQUESTS), fallback CONSUMER_<NAME>, rồi default.
+    """
+    suffix = queue_name.upper().replace(".", "_").replace("-", "_")
+    value = os.getenv(f"CONSUMER_{name}_{suffix}") or os.getenv(f"CONSUMER_{name}")
+    return int(value) if value else default
+
+
+@dataclass
+class MessageContext:
+    """Một message đã decode + thông tin route. Handler nhận ctx, trả {"status": ..., "body": ...}."""
+
+    message: aio_pika.abc.AbstractIncomingMessage
+    body: dict
+    params: dict[str, Any] = field(default_factory=dict)
+    handler_name: str = ""
+    handler: "Handler | None" = None
+
+    @property
+    def correlation_id(self) -> str | None:
+        return self.body.get("correlation_id")
+
+    @property
+    def action(self) -> str:
+        return self.body.get("action", "")
+
+    @property
+    def path(self) -> str:
+        return self.body.get("path", "")
+
+    @property
+    def payload(self) -> dict:
+        return self.body.get("payload") or {}
+
+    @property
+    def headers(self) -> dict:
+        return self.body.get("headers") or {}
+
+    @property
+    def session(self) -> str | None:
+        return self.headers.get("x-session") or self.headers.get("X-Session")
+
+    @property
+    def trace(self) -> dict:
+        return {"correlation_id": self.correlation_id, "path": self.path, "action": self.action, "deadline": self.body.get("deadline")}
+
+
+Handler = Callable[[MessageContext], Awaitable[dict]]
+Middleware = Callable[[MessageContext, Handler], Awaitable["dict | None"]]
+
+
+class Router:
+    """
+    Route theo path (bỏ prefix service, VD /api/account) rồi theo action.
+    - Static path: dict lookup trực tiếp.
+    - Template có param ({user_id}): key là "shape" của path, segment toàn số → "*"; param convert int.
+    - Action: fallback cho message không có path khớp (VD health, login với action rỗng).
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix.rstrip("/")
+        self._static: dict[str, tuple[str, Handler]] = {}
+        self._templates: dict[str, tuple[str, Handler, tuple[tuple[int, str], ...]]] = {}
+        self._actions: dict[str, tuple[str, Handler]] = {}
+        self._default: tuple[str, Handler] | None = None
+
+    def route(self, template: str):
+        """Đăng ký handler cho path template tương đối, VD "me", "admin/users/{user_id}"."""
+        segments = template.strip("/").split("/")
+        params = tuple((i, seg[1:-1]) for i, seg in enumerate(segments) if seg.startswith("{") and seg.endswith("}"))
+
+        def decorator(fn: Handler) -> Handler:
+            if params:
+                shape = "/".join("*" if seg.startswith("{") else seg for seg in segments)
+                self._templates[shape] = (fn.__name__, fn, params)
+            else:
+                self._static["/".join(segments)] = (fn.__name__, fn)
+            return fn
+
+        return decorator
+
+    def action(self, *names: str):
+        """Đăng ký handler theo action (segment cuối của path do producer gửi)."""
+
+        def decorator(fn: Handler) -> Handler:
+            for name in names:
+                self._actions[name] = (fn.__name__, fn)
+            return fn
+
+        return decorator
+
+    def default(self, fn: Handler) -> Handler:
+        """Handler khi không route/action nào khớp."""
+        self._default = (fn.__name__, fn)
+        return fn
+
+    def resolve(self, path: str, action: str) -> tuple[str, Handler, dict[str, Any]] | None:
+        # Khớp theo segment: prefix /api/account không được nhận /api/accounts/...
+        if path and self.prefix and (path == self.prefix or path.startswith(self.prefix + "/")):
+            rel = path[len(self.prefix):].strip("/")
+            found = self._static.get(rel)
+            if found:
+                return found[0], found[1], {}
+            segments = rel.split("/")
+            shape = "/".join("*" if seg.isdigit() else seg for seg in segments)
+            tmpl = self._templates.get(shape)
+            if tmpl:
+                return tmpl[0], tmpl[1], {name: int(segments[i]) for i, name in tmpl[2]}
+        found = self._actions.get(action)
+        if found:
+            return found[0], found[1], {}
+        if self._default:
+            return self._default[0], self._default[1], {}
+        return None
+
+
+# --- Middleware ---
+
+def reply_middleware(consumer: "Consumer") -> Middleware:
+    """Gửi kết quả về producer qua store_response (transport theo message); None = không trả lời."""
+
+    async def mw(ctx: MessageContext, call_next: Handler) -> dict | None:
+        result = await call_next(ctx)
+        if result is not None and ctx.correlation_id:
+            await store_response(consumer.redis, ctx.correlation_id, result, logger=consumer.logger, reply_to=ctx.body.get("reply_to"), message=ctx.message)
+        return result
+
+    return mw
+
+
+def deadline_middleware(consumer: "Consumer") -> Middleware:
+    """Producer đã trả 504 — bỏ qua, không làm việc mà không ai đọc kết quả."""
+
+    async def mw(ctx: MessageContext, call_next: Handler) -> dict | None:
+        if is_expired(ctx.body):
+            record_expired(consumer.logger, consumer.service_name, consumer.queue_name, ctx.body)
+            return None
+        return await call_next(ctx)
+
+    return mw
+
+
+def tracing_middleware(consumer: "Consumer") -> Middleware:
+    async def mw(ctx: MessageContext, call_next: Handler) -> dict | None:
+        tracer = get_tracer(consumer.service_name)
+        if not tracer:
+            return await call_next(ctx)
+        attributes = {"messaging.operation": "process", "action": ctx.action, "handler": ctx.handler_name, "correlation_id": str(ctx.correlation_id or "")}
+        with tracer.start_as_current_span(f"{consumer.short_name}.process", attributes=attributes):
+            return await call_next(ctx)
+
+    return mw
+
+
+def request_log_middleware(consumer: "Consumer") -> Middleware:
+    async def mw(ctx: MessageContext, call_next: Handler) -> dict | None:
+        if should_log_request_flow():
+            log_event(consumer.logger, "rmq_message_received", queue=consumer.queue_name, correlation_id=ctx.correlation_id, action=ctx.action, path=ctx.path, handler=ctx.handler_name)
+        return await call_next(ctx)
+
+    return mw
+
+
+def metrics_middleware(consumer: "Consumer") -> Middleware:
+    """consumer_handler_duration_seconds + consumer_messages_total{status} theo handler."""
+    latency = get_histogram("consumer_handler_duration_seconds", "Consumer handler latency", ("queue", "handler"))
+    count = get_counter("consumer_messages_total", "Messages handled by consumer", ("queue", "handler", "status"))
+
+    async def mw(ctx: MessageContext, call_next: Handler) -> dict | None:
+        start = time.perf_counter()
+        status = 500
+        try:
+            result = await call_next(ctx)
+            status = (result or {}).get("status", 200)
+            return result
+        finally:
+            latency.labels(queue=consumer.queue_name, handler=ctx.handler_name).observe(time.perf_counter() - start)
+            count.labels(queue=consumer.queue_name, handler=ctx.handler_name, status=str(status)).inc()
+
+    return mw
+
+
+def error_middleware(consumer: "Consumer") -> Middleware:
+    """HTTPException (VD session hết hạn) → status tương ứng; exception khác → log consumer_error + response 500."""
+
+    async def mw(ctx: MessageContext, call_next: Handler) -> dict | None:
+        try:
+            return await call_next(ctx)
+        except HTTPException as e:
+            return {"status": e.status_code, "body": {"detail": e.detail}}
+        except Exception as e:
+            log_error_event(
+                consumer.logger,
+                "consumer_error",
+                exc=e,
+                correlation_id=ctx.correlation_id,
+                path=ctx.path,
+                action=ctx.action,
+                service=consumer.service_name,
+                queue=consumer.queue_name,
+            )
+            return {"status": 500, "body": {"detail": str(e)}}
+
+    return mw
+
+
+DEFAULT_MIDDLEWARE = (reply_middleware, deadline_middleware, tracing_middleware, request_log_middleware, metrics_middleware, error_middleware)
+
+
+class Consumer:
+    """
+    Consumer cho 1 request queue: decode → resolve route → middleware chain → handler.
+    middleware: factory nhận consumer, trả Middleware; thứ tự từ ngoài vào trong.
+    prefetch: số message broker giao trước (CONSUMER_PREFETCH[_<QUEUE>], default 5).
+    concurrency: số message xử lý đồng thời (CONSUMER_CONCURRENCY[_<QUEUE>], default = prefetch);
+    phần còn lại chờ local (queued). Handler dùng async engine (common.db.AsyncSessionLocal) — DB I/O không block loop.
+    """
+
+    def __init__(
+        self,
+        service_name: str,
+        queue_name: str,
+        router: Router,
+        logger: "Logger",
+        middleware: tuple[Callable[["Consumer"], Middleware], ...] = DEFAULT_MIDDLEWARE,
+        prefetch: int | None = None,
+        concurrency: int | None = None,
+    ):
+        self.service_name = service_name
+        self.short_name = service_name.removesuffix("-service")
+        self.queue_name = queue_name
+        self.router = router
+        self.logger = logger
+        self.prefetch = prefetch or consumer_setting("PREFETCH", queue_name, 5)
+        self.concurrency = concurrency or consumer_setting("CONCURRENCY", queue_name, self.prefetch)
+        self.redis: Redis | None = None
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._inflight = get_gauge("consumer_inflight_messages", "Messages being processed", ("queue",)).labels(queue=queue_name)
+        self._queued = get_gauge("consumer_queued_messages", "Prefetched messages waiting for a concurrency slot", ("queue",)).labels(queue=queue_name)
+        self._wait = get_histogram("consumer_slot_wait_seconds", "Time a prefetched message waited for a concurrency slot", ("queue",)).labels(queue=queue_name)
+        self._processing = get_histogram("consumer_processing_seconds", "Time to process one message (decode → reply)", ("queue",)).labels(queue=queue_name)
+        self._chain = self._build_chain([factory(self) for factory in middleware])
+
+    def _build_chain(self, middleware: list[Middleware]) -> Handler:
+        async def dispatch(ctx: MessageContext) -> dict:
+            return await self._handler(ctx)
+
+        chain: Handler = dispatch
+        for mw in reversed(middleware):
+            chain = (lambda m, nxt: (lambda ctx: m(ctx, nxt)))(mw, chain)
+        return chain
+
+    async def _handler(self, ctx: MessageContext) -> dict:
+        if ctx.handler is None:
+            return {"status": 404, "body": {"detail": f"Unknown action: {ctx.action}"}}
+        return await ctx.handler(ctx)
+
+    async def process_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        received = time.perf_counter()
+        self._queued.inc()
+        async with self._slots:
+            self._queued.dec()
+            started = time.perf_counter()
+            self._wait.observe(started - received)
+            self._inflight.inc()
+            try:
+                await self._process(message)
+            finally:
+                self._inflight.dec()
+                self._processing.observe(time.perf_counter() - started)
+
+    async def _process(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        async with message.process():
+            try:
+                body = decode_message(message)
+            except Exception as e:
+                log_error_event(self.logger, "consumer_error", exc=e, correlation_id=message.correlation_id, service=self.service_name, queue=self.queue_name)
+                await self._reply_undecodable(message, e)
+                return
+            ctx = MessageContext(message=message, body=body)
+            resolved = self.router.resolve(ctx.path, ctx.action)
+            if resolved:
+                ctx.handler_name, ctx.handler, ctx.params = resolved
+            else:
+                ctx.handler_name = "unknown"
+            try:
+                await self._chain(ctx)
+            except Exception as e:
+                log_error_event(self.logger, "consumer_error", exc=e, correlation_id=ctx.correlation_id, service=self.service_name, queue=self.queue_name)
+
+    async def _reply_undecodable(self, message: aio_pika.abc.AbstractIncomingMessage, exc: Exception) -> None:
+        """
+        Body không decode được: trả 400 (codec lạ / body hỏng) hoặc 500 thay vì để producer chờ tới timeout.
+        correlation_id lấy từ AMQP property, reply list (redis push) từ header x-reply-to; không có → chỉ drop.
+        """
+        if not message.correlation_id:
+            return
+        result = {"status": 400 if isinstance(exc, ValueError) else 500, "body": {"detail": f"Invalid message: {exc}"}}
+        try:
+            await store_response(self.redis, message.correlation_id, result, logger=self.logger, reply_to=(message.headers or {}).get("x-reply-to"), message=message)
+        except Exception as e:
+            log_error_event(self.logger, "consumer_error", exc=e, correlation_id=message.correlation_id, service=self.service_name, queue=self.queue_name)
+
+    async def run(self, redis: Redis, url: str = RABBITMQ_URL) -> None:
+        """Kết nối, consume queue, chạy mãi (cancel để dừng)."""
+        self.redis = redis
+        connection = await aio_pika.connect_robust(url)
+        try:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=self.prefetch)
+            queue = await channel.declare_queue(self.queue_name, durable=True)
+            await queue.consume(self.process_message)
+            log_event(self.logger, "rabbitmq_connected")
+            log_event(self.logger, f"{self.short_name}_consumer_started", queue=self.queue_name, service=self.service_name, prefetch=self.prefetch, concurrency=self.concurrency)
+            await asyncio.Future()
+        finally:
+            await connection.close()
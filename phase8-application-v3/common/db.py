@@ -1,7 +1,11 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from typing import TYPE_CHECKING
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import Table, create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase
+from typing import TYPE_CHECKING, Any, Callable, TypeVar
 
 if TYPE_CHECKING:
     from logging import Logger
@@ -10,6 +14,13 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 # Pool: 500 max_connections / ~20 pods ≈ 25 per pod. Env để tune khi scale.
 POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "15"))
 MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+# Sync engine chỉ còn create_all + job nền (partition, ensure_indexes) — pool nhỏ cố định, không giữ thêm
+# POOL_SIZE connection/pod ngoài async engine (tính vào max_connections của Postgres)
+SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", "2"))
+# Thread pool cho job DB đồng bộ (run_db) — mặc định = pool sync để thread không phải chờ connection
+DB_THREAD_POOL_SIZE = int(os.getenv("DB_THREAD_POOL_SIZE", str(SYNC_POOL_SIZE)))
+
+T = TypeVar("T")
 
 if DATABASE_URL and DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
@@ -18,12 +29,112 @@ engine = create_engine(
     DATABASE_URL,
     future=True,
     pool_pre_ping=True,
+    pool_size=SYNC_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=30,
+    pool_recycle=600,
+)
+
+# Async engine (psycopg async, cùng DATABASE_URL, pool DB_POOL_SIZE/DB_MAX_OVERFLOW) — handler trong consumer dùng
+# cái này để không block event loop. Sync engine chỉ cho create_all và job DDL (partition, ensure_indexes) qua run_db; chỉ mở connection khi dùng.
+async_engine = create_async_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
     pool_size=POOL_SIZE,
     max_overflow=MAX_OVERFLOW,
     pool_timeout=30,
     pool_recycle=600,
 )
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+# expire_on_commit=False: đọc attribute sau commit không phát sinh lazy load (không được phép trong async)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREAD_POOL_SIZE, thread_name_prefix="db")
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Chạy hàm DB đồng bộ trên thread pool giới hạn — không block event loop (health, metrics, AMQP)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _index_spec(index) -> str:
+    """"[USING method] (col [opclass], ...)" từ postgresql_using / postgresql_ops của Index."""
+    opts = index.dialect_options["postgresql"]
+    ops = opts["ops"] or {}
+    columns = ", ".join(f"{c.name} {ops[c.name]}" if c.name in ops else c.name for c in index.columns)
+    return f"{'USING ' + opts['using'] + ' ' if opts['using'] else ''}({columns})"
+
+
+def _create_index(conn, table: str, index, name: str | None = None) -> None:
+    conn.execute(text(f"CREATE {'UNIQUE ' if index.unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name or index.name} ON {table} {_index_spec(index)}"))
+
+
+def _index_extensions(index) -> set[str]:
+    return set(index.info.get("extensions", ()))
+
+
+def _create_extensions(conn, tables, logger: "Logger | None" = None, savepoint: bool = False) -> set[str]:
+    """
+    Extension mà index cần (Index info["extensions"], VD pg_trgm cho GIN trigram) — trước CREATE INDEX.
+    Lỗi (thiếu quyền CREATE, extension chưa cài) → log db_index_create_failed cho từng index phụ thuộc; trả các
+    extension không có để caller bỏ qua index đó. savepoint: conn đang trong transaction (create_all) — lệnh lỗi
+    không được làm hỏng cả transaction.
+    """
+    indexes = [index for t in tables for index in t.indexes if _index_extensions(index)]
+    missing = set()
+    for extension in sorted({e for index in indexes for e in _index_extensions(index)}):
+        try:
+            if savepoint:
+                with conn.begin_nested():
+                    conn.execute(text(f"CREATE EXTENSION IF NOT EXISTS {extension}"))
+            else:
+                conn.execute(text(f"CREATE EXTENSION IF NOT EXISTS {extension}"))
+        except Exception as e:
+            missing.add(extension)
+            if logger:
+                from common.logging_utils import log_error_event
+                for index in indexes:
+                    if extension in _index_extensions(index):
+                        log_error_event(logger, "db_index_create_failed", exc=e, index=index.name, extension=extension)
+    return missing
+
+
+def ensure_indexes(*tables: Table, logger: "Logger | None" = None) -> list[str]:
+    """
+    create_all không thêm index mới vào bảng đã tồn tại: tạo index còn thiếu bằng CREATE INDEX CONCURRENTLY
+    (không chặn ghi trên bảng lớn; cần autocommit). Nhiều replica cùng chạy an toàn nhờ IF NOT EXISTS.
+    Bảng partitioned không build CONCURRENTLY được: tạo index rỗng ON ONLY bảng cha, build CONCURRENTLY từng
+    partition rồi ATTACH (index cha hợp lệ khi đủ partition). Giữ USING / opclass của Index (GIN trigram...);
+    index cần extension không tạo được thì bỏ qua (đã log). Trả tên các index đã tạo.
+    """
+    created = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        missing = _create_extensions(conn, tables, logger)
+        for table in tables:
+            existing = set(conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": table.name}).scalars().all())
+            partitioned = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table.name}).scalar() == "p"
+            for index in table.indexes:
+                if index.name in existing or _index_extensions(index) & missing:
+                    continue
+                try:
+                    if partitioned:
+                        conn.execute(text(f"CREATE {'UNIQUE ' if index.unique else ''}INDEX IF NOT EXISTS {index.name} ON ONLY {table.name} {_index_spec(index)}"))
+                        partitions = conn.execute(text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:t)"), {"t": table.name}).scalars().all()
+                        for partition in partitions:
+                            child = f"{partition}_{index.name}"[:63]
+                            _create_index(conn, partition, index, child)
+                            conn.execute(text(f"ALTER INDEX {index.name} ATTACH PARTITION {child}"))
+                    else:
+                        _create_index(conn, table.name, index)
+                    created.append(index.name)
+                except Exception as e:
+                    # Replica khác đang build cùng index, hoặc build lỗi để lại index INVALID (DROP rồi restart)
+                    if logger:
+                        from common.logging_utils import log_error_event
+                        log_error_event(logger, "db_index_create_failed", exc=e, index=index.name)
+    if created and logger:
+        from common.logging_utils import log_event
+        log_event(logger, "db_indexes_created", indexes=created)
+    return created
 
 
 def log_db_pool_status(logger: "Logger | None" = None) -> None:
@@ -32,10 +143,26 @@ def log_db_pool_status(logger: "Logger | None" = None) -> None:
         return
     try:
         from common.logging_utils import log_event
-        log_event(logger, "db_pool_ready", pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+        log_event(logger, "db_pool_ready", pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, sync_pool_size=SYNC_POOL_SIZE, thread_pool_size=DB_THREAD_POOL_SIZE)
     except Exception:
         pass
 
 
 class Base(DeclarativeBase):
     pass
+
+
+def _skip_ddl(*args, **kw) -> bool:
+    return False
+
+
+@event.listens_for(Base.metadata, "before_create")
+def _before_create(metadata, connection, tables=(), **kw) -> None:
+    # create_all chạy lúc import service: extension không tạo được thì bỏ index cần nó, không làm hỏng startup
+    from common.logging_utils import get_json_logger
+
+    missing = _create_extensions(connection, tables, get_json_logger("db"), savepoint=True)
+    for table in tables:
+        for index in table.indexes:
+            if _index_extensions(index) & missing:
+                index.ddl_if(callable_=_skip_ddl)
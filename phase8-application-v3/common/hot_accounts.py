@@ -0,0 +1,103 @@
+"""
+Hot account mode (opt-in): nhiều user cùng trả cho 1 tài khoản (merchant) → mọi transfer xếp hàng trên row lock
+users của người nhận. Tài khoản được chỉ định (HOT_ACCOUNT_NUMBERS) có HOT_ACCOUNT_SHARDS row account_shards:
+- credit: cộng vào 1 shard ngẫu nhiên, KHÔNG lock row users của người nhận → K transfer song song.
+- debit (hot account chuyển đi): lock row users rồi toàn bộ shard (theo thứ tự shard), gộp shard vào balance
+  rồi mới kiểm tra số dư → tổng nhất quán.
+- consolidate định kỳ gộp shard về users.balance. Đọc số dư = users.balance + SUM(shards) (shard_balance).
+Thứ tự lock luôn: row users (theo id) → row shard (theo account_id, shard) — không tạo chu trình deadlock.
+"""
+import os
+import random
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import AccountShard, User
+
+HOT_ACCOUNT_NUMBERS = [x.strip() for x in os.getenv("HOT_ACCOUNT_NUMBERS", "").split(",") if x.strip()]
+HOT_ACCOUNT_SHARDS = int(os.getenv("HOT_ACCOUNT_SHARDS", "8"))
+HOT_ACCOUNT_CONSOLIDATE_INTERVAL_SECONDS = float(os.getenv("HOT_ACCOUNT_CONSOLIDATE_INTERVAL_SECONDS", "5"))
+
+
+def shard_balance(account_id_col):
+    """Scalar subquery SUM(shards) cho 1 account — dùng trong select đọc số dư."""
+    return (
+        select(func.coalesce(func.sum(AccountShard.balance), 0))
+        .where(AccountShard.account_id == account_id_col)
+        .scalar_subquery()
+    )
+
+
+async def shard_total(db: AsyncSession, account_id: int) -> int:
+    """Phần số dư đang nằm trong shard (chưa consolidate) — 0 với tài khoản thường."""
+    return (await db.execute(select(shard_balance(account_id)))).scalar()
+
+
+class HotAccounts:
+    """Danh sách hot account đã resolve (id, account_number, username) trong process."""
+
+    def __init__(self):
+        self.ids: set[int] = set()
+        self.account_numbers: set[str] = set()
+        self.usernames: set[str] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.ids)
+
+    def targets(self, to_account: str, to_username: str) -> bool:
+        return (to_account in self.account_numbers) if to_account else (to_username in self.usernames)
+
+    async def load(self, db: AsyncSession, account_numbers: list[str] = HOT_ACCOUNT_NUMBERS, shards: int = HOT_ACCOUNT_SHARDS) -> None:
+        """Resolve account number → user và tạo đủ shard row (ON CONFLICT DO NOTHING)."""
+        if not account_numbers:
+            return
+        users = (await db.execute(select(User.id, User.account_number, User.username).where(User.account_number.in_(account_numbers)))).all()
+        if users:
+            await db.execute(
+                insert(AccountShard).values([{"account_id": u.id, "shard": i, "balance": 0} for u in users for i in range(shards)]).on_conflict_do_nothing()
+            )
+            await db.commit()
+        # Account từng hot (còn shard) nhưng đã bỏ khỏi env vẫn được gộp nốt bởi consolidate
+        self.ids = {u.id for u in users}
+        self.account_numbers = {u.account_number for u in users}
+        self.usernames = {u.username for u in users}
+
+    async def credit(self, db: AsyncSession, account_id: int, amount: int) -> None:
+        """Cộng vào 1 shard ngẫu nhiên — chỉ lock row shard đó."""
+        result = await db.execute(
+            update(AccountShard)
+            .where(AccountShard.account_id == account_id, AccountShard.shard == random.randrange(HOT_ACCOUNT_SHARDS))
+            .values(balance=AccountShard.balance + amount)
+        )
+        if result.rowcount != 1:
+            raise RuntimeError(f"Missing shard rows for hot account {account_id}")
+
+    async def fold(self, db: AsyncSession, user: User) -> None:
+        """Gộp mọi shard vào user.balance (user đã lock FOR UPDATE). Sau đó user.balance là tổng số dư."""
+        shards = (await db.execute(
+            select(AccountShard.balance).where(AccountShard.account_id == user.id).order_by(AccountShard.shard).with_for_update()
+        )).scalars().all()
+        total = sum(shards)
+        if total:
+            await db.execute(update(AccountShard).where(AccountShard.account_id == user.id).values(balance=0))
+            user.balance += total
+            # Flush ngay (ngoài mọi SAVEPOINT): shard đã về 0, balance gộp không được mất khi savepoint sau rollback
+            await db.flush()
+
+    async def consolidate(self, db: AsyncSession) -> int:
+        """Gộp shard → users.balance cho mọi account còn shard khác 0. Trả số account đã gộp."""
+        account_ids = (await db.execute(
+            select(AccountShard.account_id).where(AccountShard.balance != 0).distinct().order_by(AccountShard.account_id)
+        )).scalars().all()
+        for account_id in account_ids:
+            user = (await db.execute(select(User).where(User.id == account_id).with_for_update())).scalar_one_or_none()
+            if user:
+                await self.fold(db, user)
+            await db.commit()
+        return len(account_ids)
+
+
+HOT = HotAccounts()
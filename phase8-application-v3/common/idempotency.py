@@ -0,0 +1,83 @@
+"""
+Idempotency-Key cho request ghi tiền (transfer):
+- Producer forward header `Idempotency-Key` vào message headers (`idempotency-key`).
+- Kết quả thành công lần đầu được ghi vào bảng idempotency_keys CÙNG transaction với transfer (PK user_id + key)
+  → 2 request trùng key chạy song song: request sau vi phạm PK, rollback, trả kết quả của request trước.
+- Redis là fast path: `idem:{user_id}:{key}` (TTL IDEMPOTENCY_TTL_SECONDS), index zset `idem:index` giữ tối đa
+  IDEMPOTENCY_MAX_KEYS key mới nhất. Replay không chạm tới row users.
+- Row DB cũ hơn TTL bị xoá định kỳ (purge_expired). Request bị từ chối (400/404) không lưu — retry chạy lại, không có tiền nào đã chuyển.
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from redis.asyncio import Redis
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import IdempotencyKey
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "300"))
+MAX_KEY_LENGTH = 128
+HEADER = "idempotency-key"
+_INDEX_KEY = "idem:index"
+
+
+def valid_key(key: str) -> bool:
+    return 0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()
+
+
+def request_hash(payload: dict) -> str:
+    """Fingerprint payload — cùng key nhưng khác nội dung → 422 thay vì replay nhầm."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def _redis_key(user_id: int, key: str) -> str:
+    return f"idem:{user_id}:{key}"
+
+
+async def get_cached(redis: Redis, user_id: int, key: str) -> dict[str, Any] | None:
+    """{"hash": ..., "response": {...}} hoặc None."""
+    raw = await redis.get(_redis_key(user_id, key))
+    return json.loads(raw) if raw else None
+
+
+async def remember(redis: Redis, user_id: int, key: str, req_hash: str, response: dict) -> None:
+    """Ghi fast path + giữ index trong giới hạn IDEMPOTENCY_MAX_KEYS (bỏ key cũ nhất)."""
+    member = f"{user_id}:{key}"
+    now = time.time()
+    pipe = redis.pipeline(transaction=False)
+    pipe.setex(_redis_key(user_id, key), IDEMPOTENCY_TTL_SECONDS, json.dumps({"hash": req_hash, "response": response}))
+    pipe.zadd(_INDEX_KEY, {member: now})
+    pipe.zremrangebyscore(_INDEX_KEY, "-inf", now - IDEMPOTENCY_TTL_SECONDS)
+    pipe.zcard(_INDEX_KEY)
+    size = (await pipe.execute())[-1]
+    if size > IDEMPOTENCY_MAX_KEYS:
+        evicted = await redis.zpopmin(_INDEX_KEY, size - IDEMPOTENCY_MAX_KEYS)
+        if evicted:
+            await redis.delete(*(f"idem:{m}" for m, _ in evicted))
+
+
+async def lookup(db: AsyncSession, user_id: int, key: str) -> dict[str, Any] | None:
+    row = (await db.execute(select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key))).scalar_one_or_none()
+    if not row:
+        return None
+    return {"hash": row.request_hash, "response": json.loads(row.response)}
+
+
+def record(db: AsyncSession, user_id: int, key: str, req_hash: str, response: dict) -> None:
+    """Thêm row vào transaction hiện tại — commit cùng transfer."""
+    db.add(IdempotencyKey(user_id=user_id, key=key, request_hash=req_hash, response=json.dumps(response, ensure_ascii=False)))
+
+
+async def purge_expired(db: AsyncSession, ttl: int = IDEMPOTENCY_TTL_SECONDS) -> int:
+    """Xoá row cũ hơn ttl (index created_at). Trả số row đã xoá."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl)
+    result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+    await db.commit()
+    return result.rowcount or 0
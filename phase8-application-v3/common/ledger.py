@@ -0,0 +1,208 @@
+"""
+Sổ cái double-entry cho Phase 8:
+- Mỗi transfer ghi 2 LedgerEntry bất biến (debit -amount cho người gửi, credit +amount cho người nhận) trong cùng
+  transaction với transfer; tài khoản có 1 entry opening = số dư ban đầu (auth register / bootstrap_opening_entries).
+- BalanceSnapshot build tăng dần: snapshot mới = snapshot trước + tổng entry mới (chỉ đọc phần đuôi, không replay từ đầu).
+- balance_as_of: snapshot gần nhất trước T + entry đuôi (index account_id + created_at) — không chạm row users.
+- verify: duyệt entries / snapshots / users theo account_id bằng server-side cursor (bộ nhớ O(1)), báo chỗ lệch.
+
+CLI (trong pod transfer-service, hoặc từ phase8-application-v3/ với DATABASE_URL):
+  python -m common.ledger snapshot
+  python -m common.ledger verify
+"""
+import asyncio
+import os
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import AccountShard, BalanceSnapshot, LedgerEntry, Transfer, User
+
+LEDGER_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("LEDGER_SNAPSHOT_INTERVAL_SECONDS", "300"))
+# Entry mới hơn khoảng này chưa vào snapshot: id cấp lúc INSERT nhưng commit có thể trễ — tránh bỏ sót entry
+# của transaction commit sau khi snapshot đã vượt qua id của nó. Phải lớn hơn thời gian transaction dài nhất.
+LEDGER_SNAPSHOT_LAG_SECONDS = int(os.getenv("LEDGER_SNAPSHOT_LAG_SECONDS", "120"))
+BOOTSTRAP_CHUNK = 1000
+
+
+def record_transfer(db: AsyncSession, transfer: Transfer) -> None:
+    """2 entry cho transfer đã flush (có id) — commit cùng transaction."""
+    db.add(LedgerEntry(transfer_id=transfer.id, account_id=transfer.from_user, amount=-transfer.amount, kind="debit"))
+    db.add(LedgerEntry(transfer_id=transfer.id, account_id=transfer.to_user, amount=transfer.amount, kind="credit"))
+
+
+def record_opening(db: AsyncSession, user: User) -> None:
+    """Entry opening cho user mới đã flush."""
+    db.add(LedgerEntry(account_id=user.id, amount=user.balance, kind="opening"))
+
+
+async def bootstrap_opening_entries(db: AsyncSession) -> int:
+    """
+    Tạo entry opening cho user chưa có (dữ liệu trước khi bật ledger): opening = balance hiện tại − tổng entry đã có.
+    Lock user theo thứ tự id từng chunk → transfer đang chạy trên user đó commit xong trước, số liệu khớp.
+    Hot account: số dư gồm cả account_shards. Credit vào shard không lock row users → lock thêm shard FOR SHARE
+    (sau users, theo thứ tự shard như HOT.fold): credit đang chạy commit xong trước, credit mới chờ tới commit.
+    Tổng entry đọc SAU cả 2 bước lock (READ COMMITTED: statement mới thấy entry của credit vừa commit) — shard và
+    entry cùng một trạng thái, credit không bị tính 2 lần.
+    """
+    created = 0
+    while True:
+        users = (await db.execute(
+            select(User.id, User.balance)
+            .where(~select(LedgerEntry.id).where(LedgerEntry.account_id == User.id, LedgerEntry.kind == "opening").exists())
+            .order_by(User.id)
+            .limit(BOOTSTRAP_CHUNK)
+            .with_for_update()
+        )).all()
+        if not users:
+            return created
+        ids = [u.id for u in users]
+        shards: dict[int, int] = {}
+        for account_id, balance in (await db.execute(
+            select(AccountShard.account_id, AccountShard.balance)
+            .where(AccountShard.account_id.in_(ids))
+            .order_by(AccountShard.account_id, AccountShard.shard)
+            .with_for_update(read=True)
+        )).all():
+            shards[account_id] = shards.get(account_id, 0) + balance
+        sums = dict((await db.execute(
+            select(LedgerEntry.account_id, func.sum(LedgerEntry.amount)).where(LedgerEntry.account_id.in_(ids)).group_by(LedgerEntry.account_id)
+        )).all())
+        for user_id, balance in users:
+            db.add(LedgerEntry(account_id=user_id, amount=balance + (shards.get(user_id) or 0) - (sums.get(user_id) or 0), kind="opening"))
+        await db.commit()
+        created += len(users)
+
+
+_SNAPSHOT_SQL = text("""
+WITH last AS (
+    SELECT DISTINCT ON (account_id) account_id, last_entry_id, balance
+    FROM balance_snapshots
+    ORDER BY account_id, last_entry_id DESC
+),
+delta AS (
+    SELECT e.account_id, SUM(e.amount) AS amount, MAX(e.id) AS max_id, MAX(e.created_at) AS max_at
+    FROM ledger_entries e
+    LEFT JOIN last l ON l.account_id = e.account_id
+    WHERE e.id > COALESCE(l.last_entry_id, 0) AND e.id <= :upto
+    GROUP BY e.account_id
+)
+INSERT INTO balance_snapshots (account_id, last_entry_id, last_entry_at, balance, taken_at)
+SELECT d.account_id, d.max_id, d.max_at, COALESCE(l.balance, 0) + d.amount, :now
+FROM delta d LEFT JOIN last l ON l.account_id = d.account_id
+""")
+
+
+async def take_snapshots(db: AsyncSession) -> int:
+    """Snapshot mới cho mọi account có entry sau snapshot trước (tới watermark now − LAG). Trả số snapshot tạo."""
+    now = datetime.now(timezone.utc)
+    upto = (await db.execute(
+        select(func.max(LedgerEntry.id)).where(LedgerEntry.created_at < now - timedelta(seconds=LEDGER_SNAPSHOT_LAG_SECONDS))
+    )).scalar()
+    if not upto:
+        return 0
+    result = await db.execute(_SNAPSHOT_SQL, {"upto": upto, "now": now})
+    await db.commit()
+    return result.rowcount or 0
+
+
+async def balance_as_of(db: AsyncSession, account_id: int, at: datetime) -> int:
+    """Số dư tại thời điểm `at`: snapshot cuối có last_entry_at <= at + tổng entry sau snapshot đó và <= at."""
+    snap = (await db.execute(
+        select(BalanceSnapshot.last_entry_id, BalanceSnapshot.balance)
+        .where(BalanceSnapshot.account_id == account_id, BalanceSnapshot.last_entry_at <= at)
+        .order_by(BalanceSnapshot.last_entry_id.desc())
+        .limit(1)
+    )).first()
+    base_id, base = (snap.last_entry_id, snap.balance) if snap else (0, 0)
+    tail = (await db.execute(
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+        .where(LedgerEntry.account_id == account_id, LedgerEntry.id > base_id, LedgerEntry.created_at <= at)
+    )).scalar()
+    return base + tail
+
+
+@dataclass
+class Mismatch:
+    account_id: int
+    kind: str  # snapshot (snapshot ≠ snapshot trước + entries) / balance (users.balance ≠ ledger)
+    expected: int
+    actual: int
+    last_entry_id: int | None = None
+
+
+async def _rows(db: AsyncSession, stmt) -> AsyncIterator:
+    result = await db.stream(stmt.execution_options(yield_per=5000))
+    async for row in result:
+        yield row
+
+
+async def verify(db: AsyncSession) -> AsyncIterator[Mismatch]:
+    """
+    Streaming merge 3 luồng đã sắp xếp theo account_id: entries (id), snapshots (last_entry_id), users (id).
+    Mỗi snapshot phải bằng tổng chạy của entries tới last_entry_id; cuối mỗi account tổng entries phải bằng
+    users.balance + tổng account_shards (hot account, phần credit chưa consolidate).
+    Chạy trong 1 transaction REPEATABLE READ để mọi luồng cùng snapshot MVCC.
+    """
+    await db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    # Chỉ hot account có shard → dict nhỏ, đọc trong cùng snapshot
+    shards = dict((await db.execute(select(AccountShard.account_id, func.sum(AccountShard.balance)).group_by(AccountShard.account_id))).all())
+    entries = _rows(db, select(LedgerEntry.account_id, LedgerEntry.id, LedgerEntry.amount).order_by(LedgerEntry.account_id, LedgerEntry.id))
+    snapshots = _rows(db, select(BalanceSnapshot.account_id, BalanceSnapshot.last_entry_id, BalanceSnapshot.balance).order_by(BalanceSnapshot.account_id, BalanceSnapshot.last_entry_id))
+    users = _rows(db, select(User.id, User.balance).order_by(User.id))
+
+    async def _next(it):
+        return await anext(it, None)
+
+    entry, snap, user = await _next(entries), await _next(snapshots), await _next(users)
+    while user is not None:
+        account_id, running = user.id, 0
+        while entry is not None and entry.account_id < account_id:
+            entry = await _next(entries)  # entry của account không còn trong users — bỏ qua
+        while snap is not None and snap.account_id < account_id:
+            snap = await _next(snapshots)
+        while entry is not None and entry.account_id == account_id:
+            while snap is not None and snap.account_id == account_id and snap.last_entry_id < entry.id:
+                if snap.balance != running:
+                    yield Mismatch(account_id, "snapshot", running, snap.balance, snap.last_entry_id)
+                snap = await _next(snapshots)
+            running += entry.amount
+            entry = await _next(entries)
+        while snap is not None and snap.account_id == account_id:
+            if snap.balance != running:
+                yield Mismatch(account_id, "snapshot", running, snap.balance, snap.last_entry_id)
+            snap = await _next(snapshots)
+        expected = user.balance + (shards.get(account_id) or 0)
+        if running != expected:
+            yield Mismatch(account_id, "balance", running, expected)
+        user = await _next(users)
+
+
+async def _main(command: str) -> int:
+    from common.db import AsyncSessionLocal, async_engine
+
+    try:
+        async with AsyncSessionLocal() as db:
+            if command == "snapshot":
+                print(f"opening entries created: {await bootstrap_opening_entries(db)}")
+                print(f"snapshots created: {await take_snapshots(db)}")
+                return 0
+            mismatches = 0
+            async for m in verify(db):
+                mismatches += 1
+                print(f"MISMATCH account={m.account_id} kind={m.kind} expected={m.expected} actual={m.actual} last_entry_id={m.last_entry_id}")
+            print(f"verify done: {mismatches} mismatches")
+            return 1 if mismatches else 0
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("snapshot", "verify"):
+        print("usage: python -m common.ledger snapshot|verify")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main(sys.argv[1])))
@@ -1,10 +1,17 @@
-from sqlalchemy import String, Integer, DateTime, Boolean, ForeignKey
+from sqlalchemy import String, Integer, BigInteger, DateTime, Boolean, ForeignKey, Text, Index
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import datetime, timezone
 from common.db import Base
 
 class User(Base):
     __tablename__ = "users"
+    # Admin search (common/user_search.py): username chứa chuỗi qua GIN trigram; phone / account_number (chỉ chữ số)
+    # prefix LIKE 'term%' qua B-tree varchar_pattern_ops (index unique sẵn có theo collation, không phục vụ LIKE)
+    __table_args__ = (
+        Index("ix_users_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}, info={"extensions": ("pg_trgm",)}),
+        Index("ix_users_phone_prefix", "phone", postgresql_ops={"phone": "varchar_pattern_ops"}),
+        Index("ix_users_account_number_prefix", "account_number", postgresql_ops={"account_number": "varchar_pattern_ops"}),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     phone: Mapped[str] = mapped_column(String(20), unique=True, index=True)
     account_number: Mapped[str] = mapped_column(String(20), unique=True, index=True)
@@ -13,17 +20,87 @@ class User(Base):
     balance: Mapped[int] = mapped_column(Integer, default=100000)
 
 class Transfer(Base):
+    """Partition theo tháng trên created_at (common/partitions.py) — PK phải chứa partition key."""
     __tablename__ = "transfers"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Lịch sử chuyển tiền theo user: keyset (created_at, id) trên từng chiều — id cuối để ORDER BY được index phục vụ hết
+    __table_args__ = (
+        Index("ix_transfers_from_user_created_at", "from_user", "created_at", "id"),
+        Index("ix_transfers_to_user_created_at", "to_user", "created_at", "id"),
+        Index("ix_transfers_created_at_id", "created_at", "id"),  # admin list toàn bộ transfer (keyset)
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     from_user: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
     to_user: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
     amount: Mapped[int] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=lambda: datetime.now(timezone.utc))
 
 class Notification(Base):
+    """Partition theo tháng trên created_at (common/partitions.py) — PK phải chứa partition key."""
     __tablename__ = "notifications"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), index=True)
+    __table_args__ = (
+        Index("ix_notifications_user_id_created_at", "user_id", "created_at"),
+        Index("ix_notifications_created_at_id", "created_at", "id"),  # admin list toàn bộ notification (keyset)
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
     message: Mapped[str] = mapped_column(String(255))
     is_read: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=lambda: datetime.now(timezone.utc))
+
+class IdempotencyKey(Base):
+    """Kết quả lần đầu của request có Idempotency-Key — ghi cùng transaction với transfer."""
+    __tablename__ = "idempotency_keys"
+    user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    request_hash: Mapped[str] = mapped_column(String(64))
+    response: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+class LedgerEntry(Base):
+    """Bút toán bất biến (chỉ INSERT): debit amount âm, credit amount dương, opening = số dư ban đầu của tài khoản."""
+    __tablename__ = "ledger_entries"
+    __table_args__ = (
+        Index("ix_ledger_entries_account_id_id", "account_id", "id"),
+        Index("ix_ledger_entries_account_id_created_at", "account_id", "created_at"),
+    )
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # Không FK: transfers partition theo created_at nên transfers.id không có unique riêng để tham chiếu
+    transfer_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+    account_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
+    amount: Mapped[int] = mapped_column(BigInteger)
+    kind: Mapped[str] = mapped_column(String(10))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class BalanceSnapshot(Base):
+    """Số dư tài khoản sau khi cộng mọi ledger entry có id <= last_entry_id (build tăng dần từ snapshot trước)."""
+    __tablename__ = "balance_snapshots"
+    account_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_entry_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    last_entry_at: Mapped[datetime] = mapped_column(DateTime)
+    balance: Mapped[int] = mapped_column(BigInteger)
+    taken_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class AccountShard(Base):
+    """Sub-balance của tài khoản nóng (hot account): credit cộng vào 1 shard ngẫu nhiên thay vì row users."""
+    __tablename__ = "account_shards"
+    account_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    balance: Mapped[int] = mapped_column(BigInteger, default=0)
+
+class OutboxEvent(Base):
+    """Transactional outbox: ghi cùng transaction với transfer, relay (notification-service) fan-out rồi xoá."""
+    __tablename__ = "outbox_events"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    topic: Mapped[str] = mapped_column(String(50))
+    aggregate_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    payload: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class StatCounter(Base):
+    """Tổng cho admin stats, cập nhật cùng transaction với thao tác ghi; chia shard để không thành hot row."""
+    __tablename__ = "stat_counters"
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    value: Mapped[int] = mapped_column(BigInteger, default=0)
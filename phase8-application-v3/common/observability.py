@@ -4,11 +4,12 @@ Observability: OpenTelemetry tracing + Prometheus metrics.
 - Metrics: Prometheus /metrics endpoint.
 """
 import os
-from prometheus_client import Counter, Histogram, generate_latest, CollectorRegistry
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CollectorRegistry
 
 _metrics_registry: CollectorRegistry | None = None
 _request_count: Counter | None = None
 _request_latency: Histogram | None = None
+_app_metrics: dict = {}
 
 
 def init_tracing(service_name: str) -> None:
@@ -56,20 +57,52 @@ def get_tracer(service_name: str):
         return None
 
 
+def _get_registry() -> CollectorRegistry:
+    global _metrics_registry
+    if _metrics_registry is None:
+        _metrics_registry = CollectorRegistry()
+    return _metrics_registry
+
+
+def _get_metric(cls, name: str, documentation: str, labelnames: tuple[str, ...], **kwargs):
+    metric = _app_metrics.get(name)
+    if metric is None:
+        metric = cls(name, documentation, list(labelnames), registry=_get_registry(), **kwargs)
+        _app_metrics[name] = metric
+    return metric
+
+
+def get_counter(name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+    """App-level Counter trên cùng registry với /metrics (tạo lần đầu, dùng lại sau đó)."""
+    return _get_metric(Counter, name, documentation, labelnames)
+
+
+def get_gauge(name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+    """App-level Gauge trên cùng registry với /metrics."""
+    return _get_metric(Gauge, name, documentation, labelnames)
+
+
+def get_histogram(name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] | None = None) -> Histogram:
+    """App-level Histogram trên cùng registry với /metrics."""
+    kwargs = {"buckets": buckets} if buckets else {}
+    return _get_metric(Histogram, name, documentation, labelnames, **kwargs)
+
+
 def setup_metrics(service_name: str) -> None:
-    global _metrics_registry, _request_count, _request_latency
-    _metrics_registry = CollectorRegistry()
+    global _request_count, _request_latency
+    if _request_count is not None:
+        return
     _request_count = Counter(
         "http_requests_total",
         "Total HTTP requests",
         ["method", "endpoint", "status"],
-        registry=_metrics_registry,
+        registry=_get_registry(),
     )
     _request_latency = Histogram(
         "http_request_duration_seconds",
         "HTTP request latency",
         ["method", "endpoint"],
-        registry=_metrics_registry,
+        registry=_get_registry(),
     )
 
 
@@ -0,0 +1,119 @@
+"""
+Transactional outbox cho notification / realtime push của transfer:
+- Transfer chỉ INSERT 1 row outbox_events (topic "transfer") trong transaction chuyển tiền — không còn 2 INSERT
+  notifications và không publish Redis sau commit (publish lỗi = mất push).
+- Relay (notification-service, chạy được nhiều replica): lấy batch row theo id bằng FOR UPDATE SKIP LOCKED,
+  tạo Notification, cộng stats counter (notifications + transfers/transfer_amount — 1 upsert mỗi batch thay vì mỗi
+  transfer), publish notify:{user_id} qua 1 pipeline Redis, xoá row, commit.
+  Publish trước commit → commit lỗi thì batch được gửi lại: at-least-once (push có thể lặp, notification không).
+  Lỗi thiếu partition notifications (tháng mới chưa được tạo) → tạo partition rồi relay lại ở poll sau.
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable
+
+from redis.asyncio import Redis
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common import partitions, stats
+from common.db import run_db
+from common.logging_utils import log_error_event, log_event
+from common.models import Notification, OutboxEvent, Transfer, User
+from common.observability import get_counter, get_gauge, get_histogram
+
+if TYPE_CHECKING:
+    from logging import Logger
+
+OUTBOX_RELAY_BATCH_SIZE = int(os.getenv("OUTBOX_RELAY_BATCH_SIZE", "200"))
+OUTBOX_RELAY_INTERVAL_MS = float(os.getenv("OUTBOX_RELAY_INTERVAL_MS", "200"))
+TOPIC_TRANSFER = "transfer"
+
+
+def transfer_payload(transfer_id: int, sender: User, receiver: User, amount: int) -> str:
+    return json.dumps({"transfer_id": transfer_id, "from_user": sender.id, "from_username": sender.username, "to_user": receiver.id, "to_username": receiver.username, "amount": amount})
+
+
+def record_transfer(db: AsyncSession, transfer: Transfer, sender: User, receiver: User) -> None:
+    """1 event cho transfer đã flush (có id) — commit cùng transaction."""
+    db.add(OutboxEvent(topic=TOPIC_TRANSFER, aggregate_id=transfer.id, payload=transfer_payload(transfer.id, sender, receiver, transfer.amount)))
+
+
+def _fan_out(event: OutboxEvent) -> tuple[list[Notification], list[tuple[int, str]], int]:
+    """Event → notification rows + (user_id, message) cần push + amount (cho stats)."""
+    data = json.loads(event.payload)
+    amount = data["amount"]
+    sent = f"Bạn đã chuyển {amount} đến {data['to_username']}"
+    received = f"Bạn nhận {amount} từ {data['from_username']}"
+    notifications = [
+        Notification(user_id=data["from_user"], message=sent, created_at=event.created_at),
+        Notification(user_id=data["to_user"], message=received, created_at=event.created_at),
+    ]
+    return notifications, [(data["to_user"], received)], amount
+
+
+async def relay_once(db: AsyncSession, redis: Redis, batch_size: int = OUTBOX_RELAY_BATCH_SIZE) -> int:
+    """Relay tối đa batch_size event cũ nhất chưa bị replica khác giữ. Trả số event đã relay."""
+    events = (await db.execute(
+        select(OutboxEvent).order_by(OutboxEvent.id).limit(batch_size).with_for_update(skip_locked=True)
+    )).scalars().all()
+    if events:
+        pushes: list[tuple[int, str]] = []
+        created = transfers = amount = 0
+        for event in events:
+            if event.topic == TOPIC_TRANSFER:
+                notifications, event_pushes, event_amount = _fan_out(event)
+                db.add_all(notifications)
+                pushes.extend(event_pushes)
+                created += len(notifications)
+                transfers += 1
+                amount += event_amount
+        await db.flush()
+        await stats.increment(db, notifications=created, transfers=transfers, transfer_amount=amount)
+        if pushes:
+            pipe = redis.pipeline(transaction=False)
+            for user_id, message in pushes:
+                pipe.publish(f"notify:{user_id}", message)
+            await pipe.execute()
+        await db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_([e.id for e in events])))
+        await db.commit()
+    oldest = (await db.execute(select(OutboxEvent.created_at).order_by(OutboxEvent.id).limit(1))).scalar()
+    lag = (datetime.now(timezone.utc).replace(tzinfo=None) - oldest).total_seconds() if oldest else 0.0
+    get_gauge("outbox_lag_seconds", "Age of the oldest outbox event not yet relayed").set(max(lag, 0.0))
+    return len(events)
+
+
+async def ensure_partitions(logger: "Logger") -> None:
+    """Tạo partition notifications còn thiếu (cùng advisory lock với job của transfer-service) — batch lỗi được
+    relay lại ở poll sau."""
+    try:
+        created = await run_db(partitions.ensure)
+        if created:
+            log_event(logger, "partitions_created", partitions=created)
+    except Exception as e:
+        log_error_event(logger, "partition_maintenance_failed", exc=e)
+
+
+async def run_relay(session_factory: Callable[[], AsyncSession], redis: Redis, logger: "Logger") -> None:
+    """Relay liên tục: batch đầy thì chạy tiếp ngay, ít hơn thì nghỉ OUTBOX_RELAY_INTERVAL_MS."""
+    relayed = get_counter("outbox_events_relayed_total", "Outbox events relayed to notifications + Redis publish")
+    failures = get_counter("outbox_relay_failures_total", "Relay batches rolled back (retried on next poll)")
+    batch_sizes = get_histogram("outbox_relay_batch_size", "Outbox events per relay batch", buckets=(1, 5, 10, 25, 50, 100, 200, 500))
+    log_event(logger, "outbox_relay_started", batch_size=OUTBOX_RELAY_BATCH_SIZE, interval_ms=OUTBOX_RELAY_INTERVAL_MS)
+    while True:
+        try:
+            async with session_factory() as db:
+                count = await relay_once(db, redis)
+        except Exception as e:
+            failures.inc()
+            log_error_event(logger, "outbox_relay_failed", exc=e)
+            count = 0
+            if partitions.is_missing_partition(e):
+                await ensure_partitions(logger)
+        if count:
+            relayed.inc(count)
+            batch_sizes.observe(count)
+        if count < OUTBOX_RELAY_BATCH_SIZE:
+            await asyncio.sleep(OUTBOX_RELAY_INTERVAL_MS / 1000.0)
@@ -0,0 +1,84 @@
+"""
+Keyset (cursor) pagination theo (created_at, id) giảm dần — chi phí mỗi trang không đổi dù bảng lớn
+(không OFFSET). Cursor opaque cho client: base64url của "created_at ISO|id" của row cuối trang trước
+(bảng không có created_at như users: chỉ id).
+Tổng số row: count_total — ước lượng của planner (EXPLAIN, không chạy query) thay cho COUNT(*) full scan,
+chỉ đếm thật khi tập kết quả nhỏ.
+"""
+import base64
+import os
+from datetime import datetime
+
+from sqlalchemy import ColumnElement, Select, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# count=auto: ước lượng <= ngưỡng thì COUNT thật (rẻ khi filter đi qua index), lớn hơn trả ước lượng
+EXACT_COUNT_MAX = int(os.getenv("PAGINATION_EXACT_COUNT_MAX", "10000"))
+COUNT_MODES = ("auto", "exact", "none")
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode()).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Cursor → (created_at, id). Cursor hỏng → ValueError (handler trả 400)."""
+    try:
+        created_at, row_id = _decode(cursor).split("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_before(created_at: ColumnElement, row_id: ColumnElement, bound: tuple[datetime, int]) -> list[ColumnElement[bool]]:
+    """WHERE (created_at, id) < bound. Thêm cận created_at riêng để planner prune partition mới hơn cursor
+    (row comparison không prune được) và dùng làm cận index scan."""
+    return [created_at <= bound[0], tuple_(created_at, row_id) < tuple_(*bound)]
+
+
+def encode_id_cursor(row_id: int) -> str:
+    return base64.urlsafe_b64encode(str(row_id).encode()).decode().rstrip("=")
+
+
+def decode_id_cursor(cursor: str) -> int:
+    """Cursor chỉ id → id. Cursor hỏng → ValueError."""
+    try:
+        return int(_decode(cursor))
+    except ValueError as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def parse_limit(value, default: int = DEFAULT_LIMIT) -> int:
+    """limit từ query string, kẹp trong [1, MAX_LIMIT]. Không phải số → ValueError."""
+    return max(1, min(int(value or default), MAX_LIMIT))
+
+
+async def estimate_count(db: AsyncSession, query: Select) -> int:
+    """
+    Số row planner ước lượng cho query (EXPLAIN — không đọc bảng): reltuples + histogram / most-common-values
+    của cột sau ANALYZE. Sai số vài % với filter thường, có thể lệch nhiều với pattern LIKE — đủ cho "≈ N kết quả".
+    """
+    conn = await db.connection()
+    compiled = query.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    plan = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def count_total(db: AsyncSession, query: Select, mode: str = "auto") -> tuple[int | None, bool]:
+    """(tổng, có phải ước lượng) cho query đã filter (không ORDER BY / LIMIT). mode: auto / exact / none."""
+    if mode == "none":
+        return None, False
+    if mode == "auto":
+        estimate = await estimate_count(db, query)
+        if estimate > EXACT_COUNT_MAX:
+            return estimate, True
+    return (await db.execute(select(func.count()).select_from(query.subquery()))).scalar(), False
@@ -0,0 +1,252 @@
+"""
+Partition theo tháng (RANGE created_at) cho transfers + notifications:
+- ensure_partitions: tạo trước partition tháng hiện tại + PARTITION_PREMAKE_MONTHS tháng tới. Không có DEFAULT
+  partition (để DETACH CONCURRENTLY dùng được) → insert vào tháng chưa có partition sẽ lỗi, nên job chạy định kỳ
+  và tạo trước vài tháng; notification-service (ghi notifications qua outbox relay) gọi ensure lúc startup và khi
+  relay gặp lỗi thiếu partition.
+- archive_partitions: partition kết thúc trước (đầu tháng hiện tại − PARTITION_RETENTION_MONTHS) → COPY ra
+  {PARTITION_ARCHIVE_DIR}/{partition}.csv.gz → DETACH CONCURRENTLY → DROP. Export trước detach: lỗi giữa chừng thì
+  lần chạy sau export lại, không mất dữ liệu.
+- convert: chuyển 1 lần bảng thường có sẵn thành partitioned — bảng cũ thành partition {table}_legacy cho
+  (MINVALUE, đầu tháng sau), không copy dữ liệu; index/constraint chuẩn bị online trước, chỉ giữ lock ngắn.
+- window: điều kiện created_at từ since/until cho query → planner chỉ quét partition liên quan (partition pruning).
+Job đồng bộ (DDL CONCURRENTLY cần autocommit) — service gọi qua run_db. pg_try_advisory_lock: mỗi lúc 1 replica.
+
+CLI (trong pod transfer-service, hoặc từ phase8-application-v3/ với DATABASE_URL):
+  python -m common.partitions list
+  python -m common.partitions maintain
+  python -m common.partitions convert [transfers notifications]
+"""
+import gzip
+import os
+import re
+import sys
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+from typing import Iterator
+
+from sqlalchemy import Table, text
+from sqlalchemy.engine import Connection
+
+from common.db import engine, ensure_indexes
+from common.models import Notification, Transfer
+
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+# 0 = giữ mãi (không archive)
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR", "/var/lib/banking/archive")
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+# Cận dưới mặc định (ngày) cho list khi không truyền since — 0 = không cận: row cũ vẫn hiện; pruning lấy từ
+# since/until hoặc created_at của cursor (pagination.keyset_before). Chỉ bật khi chấp nhận ẩn dữ liệu cũ hơn N ngày.
+PARTITION_QUERY_WINDOW_DAYS = int(os.getenv("PARTITION_QUERY_WINDOW_DAYS", "0"))
+
+PARTITIONED_TABLES: tuple[Table, ...] = (Transfer.__table__, Notification.__table__)
+_LOCK_KEY = 8190019
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def add_months(month: date, n: int) -> date:
+    m = month.month - 1 + n
+    return date(month.year + m // 12, m % 12 + 1, 1)
+
+
+def current_month() -> date:
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def _parse_bound(value: str) -> datetime | None:
+    value = value.strip()
+    if value.upper() in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}).scalar() == "p"
+
+
+def list_partitions(conn: Connection, table: str) -> list[tuple[str, datetime | None, datetime | None]]:
+    """(tên, from, to) các partition đang attach — None = MINVALUE/MAXVALUE."""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:t) ORDER BY c.relname"
+    ), {"t": table}).all()
+    partitions = []
+    for name, bound in rows:
+        m = _BOUND_RE.search(bound or "")
+        partitions.append((name, _parse_bound(m.group(1)), _parse_bound(m.group(2))) if m else (name, None, None))
+    return partitions
+
+
+def ensure_partitions(conn: Connection, months_ahead: int = PARTITION_PREMAKE_MONTHS) -> list[str]:
+    """Partition tháng hiện tại → +months_ahead cho mọi bảng đã partition; bỏ qua tháng đã có partition phủ."""
+    created = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(conn, table.name):
+            continue  # bảng thường (DB cũ) — chạy `convert` trước
+        existing = list_partitions(conn, table.name)
+        for n in range(months_ahead + 1):
+            start = add_months(current_month(), n)
+            end = add_months(start, 1)
+            lo, hi = datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time())
+            if any((s is None or s < hi) and (e is None or e > lo) for _, s, e in existing):
+                continue
+            name = partition_name(table.name, start)
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table.name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+            created.append(name)
+    return created
+
+
+def _export(conn: Connection, partition: str, path: str) -> None:
+    """COPY partition → csv.gz (ghi file tạm rồi rename, không để lại file dở)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    raw = conn.connection.driver_connection
+    with raw.cursor() as cur, cur.copy(f"COPY {partition} TO STDOUT WITH (FORMAT csv, HEADER)") as copy, gzip.open(tmp, "wb") as f:
+        for block in copy:
+            f.write(block)
+    os.replace(tmp, path)
+
+
+def archive_partitions(conn: Connection, retention_months: int = PARTITION_RETENTION_MONTHS, archive_dir: str = PARTITION_ARCHIVE_DIR) -> list[str]:
+    """Export + detach + drop partition có to <= đầu tháng hiện tại − retention_months. Trả đường dẫn file."""
+    if retention_months <= 0:
+        return []
+    cutoff = datetime.combine(add_months(current_month(), -retention_months), datetime.min.time())
+    archived = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(conn, table.name):
+            continue
+        for name, _, end in list_partitions(conn, table.name):
+            if end is None or end > cutoff:
+                continue
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            _export(conn, name, path)
+            conn.execute(text(f"ALTER TABLE {table.name} DETACH PARTITION {name} CONCURRENTLY"))
+            conn.execute(text(f"DROP TABLE {name}"))
+            archived.append(path)
+    return archived
+
+
+@contextmanager
+def _maintenance_lock() -> Iterator[Connection | None]:
+    """Connection autocommit giữ advisory lock, None nếu replica/service khác đang giữ."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _LOCK_KEY}).scalar():
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+
+
+def maintain() -> tuple[list[str], list[str]]:
+    """Tạo partition tới + archive partition quá hạn. Replica khác đang chạy → bỏ qua, trả ([], [])."""
+    with _maintenance_lock() as conn:
+        if conn is None:
+            return [], []
+        return ensure_partitions(conn), archive_partitions(conn)
+
+
+def ensure() -> list[str]:
+    """Chỉ tạo partition còn thiếu (không archive — service không cần volume archive). Lock bận → []."""
+    with _maintenance_lock() as conn:
+        return ensure_partitions(conn) if conn is not None else []
+
+
+def is_missing_partition(exc: BaseException) -> bool:
+    """INSERT vào tháng chưa có partition (không có DEFAULT partition)."""
+    return "no partition of relation" in str(exc)
+
+
+def convert(table: Table) -> bool:
+    """
+    Bảng thường → partitioned, bảng cũ attach làm partition {table}_legacy (MINVALUE → đầu tháng sau).
+    Online trước (không chặn ghi): index của model + unique (id, created_at) CONCURRENTLY, CHECK created_at < bound
+    NOT VALID rồi VALIDATE → ATTACH không phải scan/build lại. Sau đó 1 transaction lock ngắn: đổi tên bảng/index/
+    sequence cũ, bỏ FK trỏ vào bảng cũ, tạo bảng partitioned, nối sequence, attach. False nếu đã partition sẵn.
+    """
+    name, legacy = table.name, f"{table.name}_legacy"
+    bound = add_months(current_month(), 1)
+    check = f"{name}_legacy_bound"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if is_partitioned(conn, name):
+            return False
+    ensure_indexes(table)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name}_id_created_at_key ON {name} (id, created_at)"))
+        if not conn.execute(text("SELECT 1 FROM pg_constraint WHERE conname = :c"), {"c": check}).scalar():
+            conn.execute(text(f"ALTER TABLE {name} ADD CONSTRAINT {check} CHECK (created_at < '{bound}') NOT VALID"))
+        conn.execute(text(f"ALTER TABLE {name} VALIDATE CONSTRAINT {check}"))
+    with engine.begin() as tx:
+        tx.execute(text("SET LOCAL lock_timeout = '10s'"))
+        tx.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+        seq = tx.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": name}).scalar()
+        tx.execute(text(f"ALTER TABLE {name} RENAME TO {legacy}"))
+        for index in tx.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": legacy}).scalars().all():
+            tx.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index[:55]}_legacy"'))
+        for constraint, relation in tx.execute(text(
+            "SELECT conname, conrelid::regclass::text FROM pg_constraint WHERE contype = 'f' AND confrelid = to_regclass(:t)"
+        ), {"t": legacy}).all():
+            tx.execute(text(f'ALTER TABLE {relation} DROP CONSTRAINT "{constraint}"'))
+        if seq:
+            tx.execute(text(f"ALTER SEQUENCE {seq} RENAME TO {legacy}_id_seq"))
+        table.create(tx)
+        tx.execute(text(f"SELECT setval(pg_get_serial_sequence(:t, 'id'), (SELECT COALESCE(MAX(id), 0) + 1 FROM {legacy}), false)"), {"t": name})
+        tx.execute(text(f"ALTER TABLE {name} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{bound}')"))
+        tx.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {check}"))
+    return True
+
+
+def _parse_ts(value: str) -> datetime:
+    at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return at.astimezone(timezone.utc).replace(tzinfo=None) if at.tzinfo else at
+
+
+def window(column, since: str | None = None, until: str | None = None, default_days: int = PARTITION_QUERY_WINDOW_DAYS) -> list:
+    """
+    Điều kiện [since, until) trên created_at (ISO-8601 từ query string) — cận cụ thể để planner prune partition.
+    Không có since → now − default_days (mặc định 0 = không cận dưới). Sai format → ValueError.
+    """
+    conditions = []
+    if since:
+        conditions.append(column >= _parse_ts(since))
+    elif default_days > 0:
+        conditions.append(column >= datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=default_days))
+    if until:
+        conditions.append(column < _parse_ts(until))
+    return conditions
+
+
+def _main(command: str, names: list[str]) -> int:
+    if command == "convert":
+        tables = [t for t in PARTITIONED_TABLES if not names or t.name in names]
+        for table in tables:
+            print(f"{table.name}: {'converted' if convert(table) else 'already partitioned'}")
+        created, _ = maintain()
+        print(f"partitions created: {created}")
+        return 0
+    if command == "maintain":
+        created, archived = maintain()
+        print(f"partitions created: {created}")
+        print(f"partitions archived: {archived}")
+        return 0
+    with engine.connect() as conn:
+        for table in PARTITIONED_TABLES:
+            print(f"{table.name} ({'partitioned' if is_partitioned(conn, table.name) else 'plain'}):")
+            for name, start, end in list_partitions(conn, table.name):
+                print(f"  {name}: {start or 'MINVALUE'} → {end or 'MAXVALUE'}")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("list", "maintain", "convert"):
+        print("usage: python -m common.partitions list|maintain|convert [table ...]")
+        sys.exit(2)
+    sys.exit(_main(sys.argv[1], sys.argv[2:]))
@@ -1,18 +1,54 @@
 import json
 import os
+import time
 import uuid
+from dataclasses import dataclass
 from typing import TYPE_CHECKING, Any
 from urllib.parse import urlparse, unquote
 from redis.asyncio import Redis
 from redis.asyncio.sentinel import Sentinel
+from redis.exceptions import RedisError
 from fastapi import HTTPException
 
+from common.observability import get_counter, get_histogram
+
 if TYPE_CHECKING:
     from logging import Logger
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 SESSION_TTL = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
 USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL_SECONDS", "300"))  # 5 phút
+# Cache profile + balance (balance:{user_id}): TTL chặn trên thời gian stale khi write-through sau commit bị lỡ
+BALANCE_CACHE_TTL = int(os.getenv("BALANCE_CACHE_TTL_SECONDS", "60"))
+# Tombstone (hot account, balance không tính được ở transfer-service): chặn read-fill bằng giá trị đọc trước commit
+BALANCE_CACHE_TOMBSTONE_TTL = int(os.getenv("BALANCE_CACHE_TOMBSTONE_TTL_SECONDS", "5"))
+
+
+@dataclass(frozen=True)
+class VelocityRule:
+    scope: str  # sender (user id) / receiver (số tài khoản hoặc username người nhận)
+    metric: str  # count (số transfer) / amount (tổng tiền)
+    window: int  # giây
+    limit: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.scope}_{self.metric}_{self.window}s"
+
+
+def parse_velocity_limits(spec: str) -> list[VelocityRule]:
+    """"sender:count:60:30,sender:amount:86400:50000000" → rules. Rỗng = tắt."""
+    rules = []
+    for item in (x.strip() for x in spec.split(",") if x.strip()):
+        scope, metric, window, limit = item.split(":")
+        if scope not in ("sender", "receiver") or metric not in ("count", "amount"):
+            raise ValueError(f"Invalid velocity rule {item!r}")
+        rules.append(VelocityRule(scope, metric, int(window), int(limit)))
+    return rules
+
+
+# Giới hạn tốc độ chuyển tiền: scope:metric:window_seconds:limit, phân tách bằng dấu phẩy
+VELOCITY_LIMITS = parse_velocity_limits(os.getenv("VELOCITY_LIMITS", "sender:count:60:30,sender:amount:86400:100000000,receiver:count:60:600"))
 
 
 async def create_redis_client(url: str | None = None, logger: "Logger | None" = None) -> Redis:
@@ -49,7 +85,8 @@ async def create_redis_client(url: str | None = None, logger: "Logger | None" =
 async def get_user_for_login(redis: Redis, phone: str, username: str) -> dict[str, Any] | None:
     """
     Lấy user để verify login — ưu tiên Redis cache, miss thì query DB (caller xử lý).
-    Trả về dict {id, phone, username, account_number, password_hash, balance} hoặc None.
+    Trả về dict {id, phone, username, account_number, password_hash} hoặc None. Balance không cache ở đây
+    (stale sau mỗi transfer) — đọc qua get_cached_profile.
     """
     if phone:
         key = f"user_cache:phone:{phone}"
@@ -71,7 +108,6 @@ async def set_user_for_login_cache(redis: Redis, user: dict[str, Any], ttl: int
         "username": user["username"],
         "account_number": user["account_number"],
         "password_hash": user["password_hash"],
-        "balance": user["balance"],
     }
     val = json.dumps(data)
     await redis.setex(f"user_cache:phone:{user['phone']}", ttl, val)
@@ -104,3 +140,145 @@ async def set_presence(redis: Redis, user_id: int, online: bool):
 
 async def publish_notify(redis: Redis, user_id: int, message: str):
     await redis.publish(f"notify:{user_id}", message)
+
+
+# Hash balance:{user_id}: v = version (id transfer cuối ghi vào; 0 = read-fill), p = profile JSON ('' = tombstone),
+# t = thời điểm ghi. ARGV[1] = version, ARGV[2] = p, ARGV[3] = ttl, ARGV[4] = '1' read-fill (chỉ ghi khi chưa có key),
+# ARGV[5] = t. Write-through chỉ thắng khi version mới hơn → ghi đến trễ / sai thứ tự không hồi sinh balance cũ.
+_BALANCE_SET_LUA = """
+local stored = redis.call('HGET', KEYS[1], 'v')
+if stored and (ARGV[4] == '1' or tonumber(stored) >= tonumber(ARGV[1])) then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'v', ARGV[1], 'p', ARGV[2], 't', ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+_balance_script = None
+
+
+def _balance_set(redis, user_id: int, version: int, profile: dict | None, fill: bool):
+    global _balance_script
+    if _balance_script is None:
+        _balance_script = redis.register_script(_BALANCE_SET_LUA)
+    ttl = BALANCE_CACHE_TTL if profile is not None else BALANCE_CACHE_TOMBSTONE_TTL
+    args = [version, json.dumps(profile) if profile is not None else "", ttl, int(fill), time.time()]
+    return _balance_script(keys=[f"balance:{user_id}"], args=args, client=redis)
+
+
+async def get_cached_profile(redis: Redis, user_id: int, endpoint: str) -> dict[str, Any] | None:
+    """
+    Profile {id, phone, username, account_number, balance} từ cache, None = miss / tombstone / Redis lỗi (đọc DB).
+    Metric balance_cache_requests_total{endpoint, result}, balance_cache_age_seconds (tuổi entry lúc hit).
+    """
+    requests = get_counter("balance_cache_requests_total", "Balance/profile cache lookups", ("endpoint", "result"))
+    try:
+        stored = await redis.hmget(f"balance:{user_id}", "p", "t")
+    except RedisError:
+        requests.labels(endpoint=endpoint, result="error").inc()
+        return None
+    raw, written_at = stored
+    if not raw:
+        requests.labels(endpoint=endpoint, result="miss" if raw is None else "tombstone").inc()
+        return None
+    requests.labels(endpoint=endpoint, result="hit").inc()
+    get_histogram("balance_cache_age_seconds", "Age of balance cache entries when served").observe(max(0.0, time.time() - float(written_at)))
+    return json.loads(raw)
+
+
+async def fill_profile_cache(redis: Redis, profile: dict[str, Any]) -> None:
+    """Read-fill sau khi đọc DB: chỉ ghi khi key chưa có — không đè write-through / tombstone của transfer vừa commit."""
+    try:
+        await _balance_set(redis, profile["id"], 0, profile, fill=True)
+    except RedisError:
+        pass
+
+
+async def write_profile_cache(redis: Redis, version: int, profiles: dict[int, dict[str, Any] | None]) -> None:
+    """
+    Write-through sau commit transfer `version` (transfer id — tăng dần theo thứ tự commit trên từng account nhờ row
+    lock): profile mới, hoặc None = tombstone (hot account). Mỗi key atomic trong Lua, 1 pipeline cho cả 2 account.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        for user_id, profile in profiles.items():
+            await _balance_set(pipe, user_id, version, profile, fill=False)
+        await pipe.execute()
+
+
+# Sliding window xấp xỉ bằng 2 fixed window: ước lượng = prev * (phần window trước còn nằm trong cửa sổ) + cur.
+# Kiểm tra mọi rule rồi mới cộng (all-or-nothing, atomic trong Redis) — request bị chặn không tiêu hao quota.
+# KEYS: cặp (cur, prev) từng rule. ARGV[1] = now (giây), ARGV[2] = 1 cộng / 0 chỉ kiểm tra,
+# rule i: ARGV[3i] = window, ARGV[3i+1] = limit, ARGV[3i+2] = cost. Trả {rule bị chặn (1-based, 0 = cho qua), retry_after}.
+_VELOCITY_LUA = """
+local now = tonumber(ARGV[1])
+local n = #KEYS / 2
+for i = 1, n do
+  local window = tonumber(ARGV[3 * i])
+  local limit = tonumber(ARGV[3 * i + 1])
+  local cost = tonumber(ARGV[3 * i + 2])
+  local cur = tonumber(redis.call('GET', KEYS[2 * i - 1]) or '0')
+  local prev = tonumber(redis.call('GET', KEYS[2 * i]) or '0')
+  local into = now % window
+  if prev * (1 - into / window) + cur + cost > limit then
+    return {i, math.ceil(window - into)}
+  end
+end
+if ARGV[2] == '1' then
+  for i = 1, n do
+    redis.call('INCRBY', KEYS[2 * i - 1], ARGV[3 * i + 2])
+    redis.call('EXPIRE', KEYS[2 * i - 1], 2 * tonumber(ARGV[3 * i]))
+  end
+end
+return {0, 0}
+"""
+_velocity_script = None
+
+
+@dataclass
+class VelocityDecision:
+    allowed: bool
+    rule: VelocityRule | None = None
+    retry_after: int = 0
+
+
+async def check_velocity(
+    redis: Redis,
+    sender_id: int,
+    receiver: str,
+    amount: int,
+    stage: str,
+    commit: bool = True,
+    rules: list[VelocityRule] | None = None,
+) -> VelocityDecision:
+    """
+    Kiểm tra (và ghi nhận nếu commit) 1 transfer với mọi VELOCITY_LIMITS trong 1 lệnh Lua.
+    Producer gọi commit=False (chặn sớm, không đếm — tránh đếm 2 lần); transfer-service commit=True.
+    Redis lỗi → cho qua (fail open): limiter không được làm sập luồng chuyển tiền.
+    Metric velocity_limit_decisions_total{stage, decision, rule}.
+    """
+    global _velocity_script
+    rules = VELOCITY_LIMITS if rules is None else rules
+    if not rules:
+        return VelocityDecision(True)
+    decisions = get_counter("velocity_limit_decisions_total", "Transfer velocity limiter decisions", ("stage", "decision", "rule"))
+    now = time.time()
+    keys: list[str] = []
+    args: list[Any] = [now, int(commit)]
+    for rule in rules:
+        bucket = int(now // rule.window)
+        base = f"velocity:{rule.name}:{sender_id if rule.scope == 'sender' else receiver}"
+        keys += [f"{base}:{bucket}", f"{base}:{bucket - 1}"]
+        args += [rule.window, rule.limit, amount if rule.metric == "amount" else 1]
+    if _velocity_script is None:
+        _velocity_script = redis.register_script(_VELOCITY_LUA)
+    try:
+        index, retry_after = await _velocity_script(keys=keys, args=args, client=redis)
+    except RedisError:
+        decisions.labels(stage=stage, decision="error", rule="").inc()
+        return VelocityDecision(True)
+    if not index:
+        decisions.labels(stage=stage, decision="allowed", rule="").inc()
+        return VelocityDecision(True)
+    rule = rules[int(index) - 1]
+    decisions.labels(stage=stage, decision="limited", rule=rule.name).inc()
+    return VelocityDecision(False, rule, int(retry_after))
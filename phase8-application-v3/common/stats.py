@@ -0,0 +1,101 @@
+"""
+Admin stats O(1): thay 5 aggregate full-table (COUNT users/transfers/notifications, SUM balance/amount) bằng counter
+trong stat_counters, cộng cùng transaction với thao tác ghi:
+- auth register: users +1, total_balance +số dư ban đầu
+- outbox relay: notifications +số row tạo, transfers/transfer_amount theo event transfer trong batch (chuyển tiền
+  không đổi total_balance). Transfer không tự upsert counter: upsert nằm trên đường ghi nóng nhất, mỗi transaction
+  giữ row lock 1 shard tới commit — với CONSUMER_CONCURRENCY × số pod transfer đồng thời, STATS_SHARDS nhỏ thành
+  điểm nghẽn. Relay cộng 1 lần mỗi batch (tối đa OUTBOX_RELAY_BATCH_SIZE transfer) và event chỉ bị xoá cùng
+  transaction → đếm đúng 1 lần; counter transfer trễ bằng outbox lag (outbox_lag_seconds).
+Mỗi transaction cộng vào 1 shard ngẫu nhiên (cố định trong session) trong STATS_SHARDS → register / relay song song
+ít tranh row lock; đọc = SUM theo name (STATS_SHARDS row / counter).
+reconcile: tính aggregate thật trong 1 snapshot REPEATABLE READ, so với counter cùng snapshot, ghi bù độ lệch
+(dữ liệu ghi ngoài các đường trên, partition đã archive, lần đầu bật) vào shard riêng RECONCILE_SHARD — không
+transaction ghi nào chạm shard đó nên ghi trong snapshot cũ không bị serialization failure.
+
+CLI (trong pod account-service, hoặc từ phase8-application-v3/ với DATABASE_URL):
+  python -m common.stats reconcile
+"""
+import asyncio
+import os
+import random
+import sys
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import AccountShard, Notification, OutboxEvent, StatCounter, Transfer, User
+
+STATS_SHARDS = int(os.getenv("STATS_SHARDS", "16"))
+STATS_RECONCILE_INTERVAL_SECONDS = int(os.getenv("STATS_RECONCILE_INTERVAL_SECONDS", "3600"))
+COUNTERS = ("users", "total_balance", "transfers", "transfer_amount", "notifications")
+RECONCILE_SHARD = -1
+_LOCK_KEY = 8190021
+
+
+async def increment(db: AsyncSession, shard: int | None = None, **deltas: int) -> None:
+    """Cộng delta vào counter trong transaction hiện tại. Thứ tự name cố định → không deadlock giữa transaction."""
+    if shard is None:
+        shard = db.info.setdefault("stats_shard", random.randrange(STATS_SHARDS))
+    values = [{"name": name, "shard": shard, "value": delta} for name, delta in sorted(deltas.items()) if delta]
+    if not values:
+        return
+    stmt = insert(StatCounter).values(values)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[StatCounter.name, StatCounter.shard], set_={"value": StatCounter.value + stmt.excluded.value}))
+
+
+async def read(db: AsyncSession) -> dict[str, int]:
+    rows = (await db.execute(select(StatCounter.name, func.sum(StatCounter.value)).group_by(StatCounter.name))).all()
+    totals = {name: 0 for name in COUNTERS}
+    totals.update({name: int(value) for name, value in rows})
+    return totals
+
+
+async def exact(db: AsyncSession) -> dict[str, int]:
+    """Aggregate thật — full scan, chỉ dùng cho reconcile. Transfer còn event outbox chưa relay chưa được đếm →
+    trừ ra (relay sẽ cộng), không thì reconcile bù trước rồi relay cộng lần nữa."""
+    from common.outbox import TOPIC_TRANSFER
+
+    pending = select(OutboxEvent.aggregate_id).where(OutboxEvent.topic == TOPIC_TRANSFER)
+    pending_count, pending_amount = (await db.execute(select(func.count(Transfer.id), func.coalesce(func.sum(Transfer.amount), 0)).where(Transfer.id.in_(pending)))).one()
+    return {
+        "users": (await db.execute(select(func.count(User.id)))).scalar(),
+        "total_balance": (await db.execute(select(func.coalesce(func.sum(User.balance), 0)))).scalar() + (await db.execute(select(func.coalesce(func.sum(AccountShard.balance), 0)))).scalar(),
+        "transfers": (await db.execute(select(func.count(Transfer.id)))).scalar() - pending_count,
+        "transfer_amount": (await db.execute(select(func.coalesce(func.sum(Transfer.amount), 0)))).scalar() - pending_amount,
+        "notifications": (await db.execute(select(func.count(Notification.id)))).scalar(),
+    }
+
+
+async def reconcile(db: AsyncSession) -> dict[str, int] | None:
+    """So counter với aggregate thật (cùng snapshot), ghi bù độ lệch. None = replica khác đang chạy."""
+    await db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    if not (await db.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})).scalar():
+        await db.rollback()
+        return None
+    truth = await exact(db)
+    counted = await read(db)
+    drift = {name: truth[name] - counted[name] for name in COUNTERS if truth[name] != counted[name]}
+    await increment(db, shard=RECONCILE_SHARD, **drift)
+    await db.commit()  # nhả advisory lock sau khi đã ghi bù — replica khác không bù lần 2
+    return drift
+
+
+async def _main() -> int:
+    from common.db import AsyncSessionLocal, async_engine
+
+    try:
+        async with AsyncSessionLocal() as db:
+            drift = await reconcile(db)
+        print("skipped: another reconcile is running" if drift is None else f"reconciled, drift: {drift}")
+        return 0
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "reconcile":
+        print("usage: python -m common.stats reconcile")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,512 @@
+"""
+Transfer engine dùng chung cho transfer-service (và benchmarks):
+- execute_transfer: 1 transfer / 1 transaction (hành vi mặc định, TRANSFER_ENGINE=orm).
+- execute_transfer_atomic: debit có điều kiện + credit + insert transfer/ledger/outbox trong 1 câu SQL
+  (TRANSFER_ENGINE=atomic) — row lock chỉ giữ trong 1 statement + commit.
+- execute_batch + TransferBatcher: gom tối đa N transfer hoặc T ms vào 1 transaction,
+  lock các user theo thứ tự id, mỗi transfer chạy trong SAVEPOINT riêng — 1 transfer bị từ chối/lỗi
+  không làm hỏng các transfer khác trong batch. Mỗi request vẫn nhận outcome riêng (→ store_response riêng).
+Hot account (common.hot_accounts, HOT_ACCOUNT_NUMBERS): người nhận nóng không bị lock, tiền cộng vào 1 shard
+ngẫu nhiên; người gửi nóng gộp shard vào balance trước khi kiểm tra số dư. Engine atomic chuyển sang orm khi có hot account.
+Lock luôn lấy theo thứ tự user id (rồi mới tới row shard); deadlock (40P01) / serialization failure (40001) còn sót (VD lock từ
+transaction khác) được retry với jittered backoff qua run_with_retry.
+Notification + push không ghi trong transaction: chỉ 1 row outbox_events, relay (common.outbox) fan-out sau.
+Outcome không tự log: service log transfer_success / transfer_rejected từ outcome.log để giữ nguyên format log.
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, TypeVar
+
+from sqlalchemy import or_, select, text
+from sqlalchemy.exc import DBAPIError, IntegrityError, MultipleResultsFound
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common import idempotency, ledger, outbox
+from common.hot_accounts import HOT
+from common.logging_utils import log_error_event, log_event, mask_account_number, mask_amount
+from common.models import Transfer, User
+from common.observability import get_counter, get_histogram
+from common.rabbitmq_utils import is_expired
+
+if TYPE_CHECKING:
+    from logging import Logger
+
+# Retry khi Postgres huỷ transaction do deadlock / serialization — tổng số lần thử = 1 + TRANSFER_RETRY_MAX
+TRANSFER_RETRY_MAX = int(os.getenv("TRANSFER_RETRY_MAX", "3"))
+TRANSFER_RETRY_BASE_MS = float(os.getenv("TRANSFER_RETRY_BASE_MS", "20"))
+_RETRYABLE_SQLSTATES = {"40P01": "deadlock", "40001": "serialization"}
+
+T = TypeVar("T")
+
+
+@dataclass
+class TransferRequest:
+    """Transfer đã validate input (amount > 0, có người nhận); user_id lấy từ session."""
+    user_id: int
+    amount: int
+    to_account: str
+    to_username: str
+    trace: dict = field(default_factory=dict)
+    idempotency_key: str | None = None  # có key → kết quả thành công ghi vào idempotency_keys cùng transaction
+    request_hash: str = ""
+
+
+@dataclass
+class TransferOutcome:
+    status: int
+    body: dict
+    reason: str | None = None  # lý do từ chối (transfer_rejected) hoặc deadline_exceeded
+    log: dict = field(default_factory=dict)  # field cho log transfer_success / transfer_rejected
+    replayed: bool = False  # kết quả lưu từ lần đầu của cùng Idempotency-Key — không có gì được ghi
+    # Profile sau commit theo user id cho write-through cache (redis_utils.write_profile_cache, version = transfer id);
+    # None = hot account (balance gồm shard, không tính ở đây) → tombstone
+    profiles: dict[int, dict | None] = field(default_factory=dict)
+
+    @property
+    def response(self) -> dict:
+        return {"status": self.status, "body": self.body}
+
+
+def _rejected(status: int, detail: str, reason: str, **log: Any) -> TransferOutcome:
+    return TransferOutcome(status=status, body={"detail": detail}, reason=reason, log=log)
+
+
+def deadline_outcome() -> TransferOutcome:
+    return TransferOutcome(status=504, body={"detail": "Deadline exceeded, transfer not applied"}, reason="deadline_exceeded")
+
+
+def validate(req: TransferRequest, sender: User | None, receiver: User | None) -> TransferOutcome | None:
+    """Kiểm tra nghiệp vụ trên các row đã lock. None = hợp lệ."""
+    if not sender:
+        return _rejected(404, "Sender not found", "sender_not_found", user_id=req.user_id)
+    if not receiver:
+        return _rejected(404, "Receiver not found", "receiver_not_found", to_account=req.to_account or None, to_username=req.to_username or None)
+    if receiver.id == sender.id:
+        return _rejected(400, "Cannot transfer to yourself", "self_transfer", from_user=sender.id)
+    if sender.balance < req.amount:
+        return _rejected(400, "Insufficient balance", "insufficient_balance", from_user=sender.id, amount_hash=mask_amount(req.amount), balance=sender.balance)
+    return None
+
+
+def apply(db: AsyncSession, req: TransferRequest, sender: User, receiver: User, credit_receiver: bool = True) -> Transfer:
+    """
+    Trừ/cộng balance + thêm Transfer vào session (chưa flush). Ledger entry + outbox event ghi sau flush (record, cần transfer.id).
+    credit_receiver=False: receiver là hot account không lock — caller cộng vào shard (HOT.credit).
+    """
+    amount = req.amount
+    sender.balance -= amount
+    if credit_receiver:
+        receiver.balance += amount
+    transfer = Transfer(from_user=sender.id, to_user=receiver.id, amount=amount)
+    db.add(transfer)
+    return transfer
+
+
+async def record(db: AsyncSession, sender: User, receiver: User, transfer: Transfer) -> None:
+    """Ledger entries + outbox event cho transfer đã flush — cùng transaction. Stats counter do outbox relay cộng
+    theo batch (không upsert stat_counters trên đường chuyển tiền)."""
+    ledger.record_transfer(db, transfer)
+    outbox.record_transfer(db, transfer, sender, receiver)
+
+
+def _profile(user: User) -> dict | None:
+    if user.id in HOT.ids:
+        return None
+    return {"id": user.id, "phone": user.phone, "username": user.username, "account_number": user.account_number, "balance": user.balance}
+
+
+def succeeded(req: TransferRequest, sender: User, receiver: User, transfer: Transfer) -> TransferOutcome:
+    """Outcome sau commit — transfer.id đã có (flush)."""
+    amount = req.amount
+    return TransferOutcome(
+        status=200,
+        body={"ok": True, "from": sender.username, "to": receiver.username, "to_account_number": receiver.account_number, "amount": amount},
+        log={
+            "transfer_id": transfer.id,
+            "from_user_id": sender.id,
+            "from_username": sender.username,
+            "from_account_masked": mask_account_number(sender.account_number),
+            "to_user_id": receiver.id,
+            "to_username": receiver.username,
+            "to_account_masked": mask_account_number(receiver.account_number),
+            "amount_hash": mask_amount(amount),
+        },
+        profiles={sender.id: _profile(sender), receiver.id: _profile(receiver)},
+    )
+
+
+def replay_outcome(stored: dict, req_hash: str) -> TransferOutcome:
+    """Kết quả đã lưu cho Idempotency-Key; key dùng lại với payload khác → 422."""
+    if stored["hash"] != req_hash:
+        return _rejected(422, "Idempotency-Key reused with a different request", "idempotency_key_mismatch")
+    response = stored["response"]
+    return TransferOutcome(status=response["status"], body=response["body"], replayed=True)
+
+
+async def _commit(db: AsyncSession, req: TransferRequest, outcome: TransferOutcome) -> TransferOutcome:
+    """Commit transfer (+ row idempotency_keys nếu có key). Trùng key với request song song → rollback, replay."""
+    if req.idempotency_key:
+        idempotency.record(db, req.user_id, req.idempotency_key, req.request_hash, outcome.response)
+    try:
+        await db.commit()
+    except IntegrityError:
+        if not req.idempotency_key:
+            raise
+        await db.rollback()
+        stored = await idempotency.lookup(db, req.user_id, req.idempotency_key)
+        if stored is None:
+            raise
+        return replay_outcome(stored, req.request_hash)
+    return outcome
+
+
+async def execute_transfer(db: AsyncSession, req: TransferRequest, commit_deadline: bool = False) -> TransferOutcome:
+    """
+    1 transfer / 1 transaction: tìm receiver (không lock), lock sender + receiver theo thứ tự id
+    (SELECT ... ORDER BY id FOR UPDATE — A→B và B→A không deadlock), validate, ghi, commit.
+    Receiver là hot account: không lock row users, credit vào 1 shard ngẫu nhiên.
+    commit_deadline: kiểm tra deadline ngay trước commit — quá hạn thì rollback toàn bộ.
+    """
+    if req.to_account:
+        receiver_id = (await db.execute(select(User.id).where(User.account_number == req.to_account))).scalar_one_or_none()
+    else:
+        receiver_id = (await db.execute(select(User.id).where(User.username == req.to_username))).scalar_one_or_none()
+    hot_receiver = receiver_id in HOT.ids and receiver_id != req.user_id
+    ids = {req.user_id} | ({receiver_id} if receiver_id and not hot_receiver else set())
+    locked = {u.id: u for u in (await db.execute(select(User).where(User.id.in_(ids)).order_by(User.id).with_for_update())).scalars().all()}
+    sender = locked.get(req.user_id)
+    receiver = (await db.get(User, receiver_id) if hot_receiver else locked.get(receiver_id)) if receiver_id else None
+    if sender and sender.id in HOT.ids:
+        await HOT.fold(db, sender)
+    rejection = validate(req, sender, receiver)
+    if rejection:
+        return rejection
+    transfer = apply(db, req, sender, receiver, credit_receiver=not hot_receiver)
+    await db.flush()
+    await record(db, sender, receiver, transfer)
+    if hot_receiver:
+        await HOT.credit(db, receiver.id, req.amount)
+    if commit_deadline and is_expired(req.trace):
+        await db.rollback()
+        return deadline_outcome()
+    return await _commit(db, req, succeeded(req, sender, receiver, transfer))
+
+
+# Lock sender + receiver theo thứ tự id (locked, = 2 row nghĩa là receiver tồn tại và khác sender) →
+# debit có điều kiện (đủ số dư) → credit chỉ khi debit thành công →
+# insert transfer + 2 ledger entries + 1 outbox event. Postgres chạy các data-modifying CTE trong cùng snapshot;
+# credit/insert tham chiếu RETURNING của debit nên không có gì được ghi nếu debit không match. Username trùng nhiều user
+# → subquery trả > 1 row → lỗi (giống scalar_one_or_none ở engine orm).
+_ATOMIC_TRANSFER_SQL = """
+WITH receiver AS (
+    SELECT id FROM users WHERE {receiver_filter}
+),
+locked AS (
+    SELECT id FROM users WHERE id IN (:sender_id, (SELECT id FROM receiver)) ORDER BY id FOR UPDATE
+),
+debit AS (
+    UPDATE users SET balance = balance - :amount
+    WHERE id = :sender_id AND balance >= :amount AND (SELECT count(*) FROM locked) = 2
+    RETURNING id, username, account_number, phone, balance
+),
+credit AS (
+    UPDATE users SET balance = balance + :amount
+    WHERE id = (SELECT id FROM receiver) AND EXISTS (SELECT 1 FROM debit)
+    RETURNING id, username, account_number, phone, balance
+),
+new_transfer AS (
+    INSERT INTO transfers (from_user, to_user, amount, created_at)
+    SELECT debit.id, credit.id, :amount, :now FROM debit, credit
+    RETURNING id
+),
+new_entries AS (
+    INSERT INTO ledger_entries (transfer_id, account_id, amount, kind, created_at)
+    SELECT new_transfer.id, debit.id, -:amount, 'debit', :now FROM new_transfer, debit
+    UNION ALL
+    SELECT new_transfer.id, credit.id, :amount, 'credit', :now FROM new_transfer, credit
+),
+new_outbox AS (
+    INSERT INTO outbox_events (topic, aggregate_id, payload, created_at)
+    SELECT 'transfer', new_transfer.id, json_build_object(
+        'transfer_id', new_transfer.id, 'from_user', debit.id, 'from_username', debit.username,
+        'to_user', credit.id, 'to_username', credit.username, 'amount', CAST(:amount AS bigint)
+    )::text, :now
+    FROM new_transfer, debit, credit
+)
+SELECT new_transfer.id AS transfer_id,
+       debit.id AS sender_id, debit.username AS sender_username, debit.account_number AS sender_account,
+       debit.phone AS sender_phone, debit.balance AS sender_balance,
+       credit.id AS receiver_id, credit.username AS receiver_username, credit.account_number AS receiver_account,
+       credit.phone AS receiver_phone, credit.balance AS receiver_balance
+FROM new_transfer, debit, credit
+"""
+_ATOMIC_BY_ACCOUNT = text(_ATOMIC_TRANSFER_SQL.format(receiver_filter="account_number = :to_account"))
+_ATOMIC_BY_USERNAME = text(_ATOMIC_TRANSFER_SQL.format(receiver_filter="username = :to_username"))
+
+
+async def execute_transfer_atomic(db: AsyncSession, req: TransferRequest, commit_deadline: bool = False) -> TransferOutcome:
+    """
+    1 round-trip ghi + commit: không SELECT ... FOR UPDATE trước, không kiểm tra số dư trong Python —
+    row lock của sender/receiver chỉ giữ từ UPDATE tới commit (quan trọng với receiver nóng, VD merchant).
+    Statement không ghi gì → rollback rồi đọc lại (không lock) để trả đúng lý do từ chối như engine orm.
+    Sender / receiver là hot account → dùng execute_transfer (credit vào shard thay vì UPDATE row users).
+    """
+    if HOT.enabled and (req.user_id in HOT.ids or HOT.targets(req.to_account, req.to_username)):
+        return await execute_transfer(db, req, commit_deadline)
+    params = {"sender_id": req.user_id, "amount": req.amount, "now": datetime.now(timezone.utc)}
+    if req.to_account:
+        stmt, params["to_account"] = _ATOMIC_BY_ACCOUNT, req.to_account
+    else:
+        stmt, params["to_username"] = _ATOMIC_BY_USERNAME, req.to_username
+    row = (await db.execute(stmt, params)).one_or_none()
+    if row is None:
+        await db.rollback()
+        return await _classify_rejection(db, req)
+    if commit_deadline and is_expired(req.trace):
+        await db.rollback()
+        return deadline_outcome()
+    sender = User(id=row.sender_id, username=row.sender_username, account_number=row.sender_account, phone=row.sender_phone, balance=row.sender_balance)
+    receiver = User(id=row.receiver_id, username=row.receiver_username, account_number=row.receiver_account, phone=row.receiver_phone, balance=row.receiver_balance)
+    return await _commit(db, req, succeeded(req, sender, receiver, Transfer(id=row.transfer_id)))
+
+
+async def _classify_rejection(db: AsyncSession, req: TransferRequest) -> TransferOutcome:
+    """Đọc lại sender/receiver sau khi statement atomic không ghi gì — chỉ để chọn lý do, không lock."""
+    sender = (await db.execute(select(User).where(User.id == req.user_id))).scalar_one_or_none()
+    if req.to_account:
+        receiver = (await db.execute(select(User).where(User.account_number == req.to_account))).scalar_one_or_none()
+    else:
+        receiver = (await db.execute(select(User).where(User.username == req.to_username))).scalar_one_or_none()
+    rejection = validate(req, sender, receiver)
+    if rejection:
+        return rejection
+    # Số dư đổi giữa statement và lần đọc lại (transfer khác vừa commit) — client thử lại
+    return _rejected(409, "Balance changed concurrently, please retry", "concurrent_update", from_user=req.user_id)
+
+
+async def _resolve_receivers(db: AsyncSession, reqs: list[TransferRequest]) -> tuple[dict[str, int], dict[str, list[int]]]:
+    """Map account_number / username → user id (không lock) cho cả batch bằng 1 query."""
+    accounts = {r.to_account for r in reqs if r.to_account}
+    usernames = {r.to_username for r in reqs if not r.to_account and r.to_username}
+    conditions = []
+    if accounts:
+        conditions.append(User.account_number.in_(accounts))
+    if usernames:
+        conditions.append(User.username.in_(usernames))
+    by_account: dict[str, int] = {}
+    by_username: dict[str, list[int]] = {}
+    if not conditions:
+        return by_account, by_username
+    rows = (await db.execute(select(User.id, User.account_number, User.username).where(or_(*conditions)))).all()
+    for user_id, account_number, username in rows:
+        if account_number in accounts:
+            by_account[account_number] = user_id
+        if username in usernames:
+            by_username.setdefault(username, []).append(user_id)
+    return by_account, by_username
+
+
+async def execute_batch(db: AsyncSession, reqs: list[TransferRequest]) -> list[TransferOutcome | Exception]:
+    """
+    Áp dụng nhiều transfer trong 1 transaction:
+    1. resolve người nhận (1 query), 2. lock tất cả user liên quan ORDER BY id (thứ tự cố định → không deadlock
+    giữa các batch/pod), 3. từng transfer theo thứ tự đến: validate trên balance đã cập nhật bởi transfer trước,
+    ghi trong SAVEPOINT riêng, 4. commit 1 lần.
+    Trả outcome (hoặc Exception) theo đúng thứ tự reqs. Lỗi commit → raise, caller fail cả batch.
+    Deadline được kiểm tra ngay trước khi áp dụng từng transfer: savepoint đã release thì không rollback riêng
+    được, nên TRANSFER_DEADLINE_POLICY=commit ở batch mode tương đương start + thời gian chờ batch.
+    Hot account không phải sender trong batch: không lock, credit cộng dồn rồi ghi vào shard 1 lần / account
+    ngay trước commit (theo thứ tự account id).
+    """
+    by_account, by_username = await _resolve_receivers(db, reqs)
+    receiver_ids: list[int | None] = []
+    for r in reqs:
+        if r.to_account:
+            matches = [by_account[r.to_account]] if r.to_account in by_account else []
+        else:
+            matches = by_username.get(r.to_username, [])
+        # 0 = username trùng nhiều user: giống scalar_one_or_none ở đường đơn → lỗi cho riêng transfer đó
+        receiver_ids.append(matches[0] if len(matches) == 1 else (0 if matches else None))
+    sender_ids = {r.user_id for r in reqs}
+    hot_ids = {i for i in receiver_ids if i in HOT.ids} - sender_ids
+    ids = sender_ids | {i for i in receiver_ids if i and i not in hot_ids}
+    locked = {u.id: u for u in (await db.execute(select(User).where(User.id.in_(ids)).order_by(User.id).with_for_update())).scalars().all()}
+    if hot_ids:
+        locked.update({u.id: u for u in (await db.execute(select(User).where(User.id.in_(hot_ids)))).scalars().all()})
+    for user_id in sorted(sender_ids & HOT.ids):
+        if user_id in locked:
+            await HOT.fold(db, locked[user_id])
+    hot_credits: dict[int, int] = {}
+
+    results: list[TransferOutcome | Exception | tuple] = []
+    for req, receiver_id in zip(reqs, receiver_ids):
+        sender = locked.get(req.user_id)
+        receiver = locked.get(receiver_id) if receiver_id else None
+        try:
+            if receiver_id == 0:
+                raise MultipleResultsFound(f"Multiple users with username {req.to_username!r}")
+            if is_expired(req.trace):
+                results.append(deadline_outcome())
+                continue
+            rejection = validate(req, sender, receiver)
+            if rejection:
+                results.append(rejection)
+                continue
+            hot_receiver = receiver.id in hot_ids
+            async with db.begin_nested():
+                transfer = apply(db, req, sender, receiver, credit_receiver=not hot_receiver)
+                await db.flush()
+                await record(db, sender, receiver, transfer)
+                if req.idempotency_key:
+                    idempotency.record(db, req.user_id, req.idempotency_key, req.request_hash, succeeded(req, sender, receiver, transfer).response)
+                await db.flush()
+            if hot_receiver:
+                hot_credits[receiver.id] = hot_credits.get(receiver.id, 0) + req.amount
+            results.append((req, sender, receiver, transfer))
+        except Exception as e:
+            # SAVEPOINT rollback expire các row đã sửa — load lại để transfer sau trong batch đọc đúng balance
+            for user in (sender, receiver):
+                if user is not None:
+                    await db.refresh(user)
+            # Cùng Idempotency-Key xuất hiện 2 lần trong batch → replay kết quả của lần đầu (cùng transaction)
+            stored = await idempotency.lookup(db, req.user_id, req.idempotency_key) if isinstance(e, IntegrityError) and req.idempotency_key else None
+            results.append(replay_outcome(stored, req.request_hash) if stored else e)
+    for account_id in sorted(hot_credits):
+        await HOT.credit(db, account_id, hot_credits[account_id])
+    await db.commit()
+    return [succeeded(*r) if isinstance(r, tuple) else r for r in results]
+
+
+def retry_reason(exc: BaseException) -> str | None:
+    """deadlock / serialization nếu lỗi DB retry được (sqlstate 40P01 / 40001), ngược lại None."""
+    if not isinstance(exc, DBAPIError):
+        return None
+    return _RETRYABLE_SQLSTATES.get(getattr(exc.orig, "sqlstate", None))
+
+
+async def run_with_retry(
+    session_factory: Callable[[], AsyncSession],
+    fn: Callable[..., Awaitable[T]],
+    *args: Any,
+    trace: dict | None = None,
+    logger: "Logger | None" = None,
+) -> T:
+    """
+    fn(db, *args) trong session mới mỗi lần thử. Deadlock / serialization failure → rollback (đóng session)
+    rồi thử lại sau backoff ngẫu nhiên trong [0, base * 2^attempt] (full jitter), tối đa TRANSFER_RETRY_MAX lần.
+    Không retry nữa khi request đã quá deadline (producer đã trả 504). Lỗi khác raise ngay.
+    """
+    retries = get_counter("transfer_retries_total", "Transfer transactions retried after deadlock/serialization failure", ("reason",))
+    exhausted = get_counter("transfer_retry_exhausted_total", "Transfers that failed after using the whole retry budget", ("reason",))
+    attempt = 0
+    while True:
+        try:
+            async with session_factory() as db:
+                return await fn(db, *args)
+        except DBAPIError as e:
+            reason = retry_reason(e)
+            if reason is None:
+                raise
+            if attempt >= TRANSFER_RETRY_MAX or (trace and is_expired(trace)):
+                exhausted.labels(reason=reason).inc()
+                raise
+            retries.labels(reason=reason).inc()
+            backoff = random.uniform(0, TRANSFER_RETRY_BASE_MS * (2 ** attempt)) / 1000.0
+            attempt += 1
+            if logger:
+                log_event(logger, "transfer_retry", reason=reason, attempt=attempt, backoff_ms=round(backoff * 1000, 1), correlation_id=(trace or {}).get("correlation_id"))
+            await asyncio.sleep(backoff)
+
+
+class TransferBatcher:
+    """
+    Gom transfer từ nhiều message đang xử lý đồng thời: flush khi đủ max_size hoặc sau max_wait_ms tính từ
+    transfer đầu tiên. Mỗi lúc chỉ 1 batch chạy (1 connection), batch kế tiếp gom trong lúc batch trước commit.
+    Cần consumer concurrency >= max_size để batch đầy.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        max_size: int,
+        max_wait_ms: float,
+        logger: "Logger | None" = None,
+    ):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.logger = logger
+        self._pending: list[tuple[TransferRequest, asyncio.Future]] = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._batch_size = get_histogram("transfer_batch_size", "Transfers applied per batch transaction", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+        self._batch_seconds = get_histogram("transfer_batch_duration_seconds", "Batch transaction duration (lock → commit)")
+        self._batch_failures = get_counter("transfer_batch_failures_total", "Batches whose transaction failed (all items get the error)")
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for _, fut in self._pending:
+            if not fut.done():
+                fut.set_exception(RuntimeError("Transfer batcher stopped"))
+        self._pending.clear()
+
+    async def submit(self, req: TransferRequest) -> TransferOutcome:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((req, fut))
+        self._has_items.set()
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+        return await fut
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.max_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._pending[: self.max_size]
+            del self._pending[: self.max_size]
+            if len(self._pending) < self.max_size:
+                self._full.clear()
+            if not self._pending:
+                self._has_items.clear()
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[TransferRequest, asyncio.Future]]) -> None:
+        # Message đã bị huỷ (consumer shutdown) thì bỏ khỏi batch
+        batch = [(req, fut) for req, fut in batch if not fut.done()]
+        if not batch:
+            return
+        self._batch_size.observe(len(batch))
+        start = time.perf_counter()
+        try:
+            outcomes = await run_with_retry(self.session_factory, execute_batch, [req for req, _ in batch], logger=self.logger)
+        except Exception as e:
+            self._batch_failures.inc()
+            if self.logger:
+                log_error_event(self.logger, "transfer_batch_failed", exc=e, size=len(batch))
+            outcomes = [e] * len(batch)
+        finally:
+            self._batch_seconds.observe(time.perf_counter() - start)
+        for (_, fut), outcome in zip(batch, outcomes):
+            if fut.done():
+                continue
+            if isinstance(outcome, Exception):
+                fut.set_exception(outcome)
+            else:
+                fut.set_result(outcome)
@@ -0,0 +1,45 @@
+"""
+Tìm user cho admin (account-service admin/users) — keyset theo id giảm dần, không OFFSET, không COUNT(*) mỗi request:
+- Term toàn chữ số: prefix phone / account_number (LIKE 'term%' → range scan B-tree varchar_pattern_ops) hoặc
+  username chứa term. Phone / account_number chỉ gồm số nên term có chữ cái không thể khớp 2 cột này.
+- Term khác: username ILIKE '%term%' qua GIN trigram (pg_trgm). Term < 3 ký tự không trích được trigram — planner
+  quét PK lùi + filter, LIMIT dừng sớm vì term ngắn thường khớp nhiều row.
+- Tổng: pagination.count_total — ước lượng planner (EXPLAIN), chỉ COUNT thật khi tập kết quả nhỏ
+  (đếm qua index rẻ) hoặc admin yêu cầu count=exact.
+"""
+from sqlalchemy import ColumnElement, Select, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.models import User
+from common.pagination import count_total
+
+
+def _escape_like(term: str) -> str:
+    # Backslash là ký tự escape mặc định của LIKE trong Postgres
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_filter(term: str) -> ColumnElement[bool]:
+    """WHERE cho term đã strip, khác rỗng."""
+    contains = User.username.ilike(f"%{_escape_like(term)}%")
+    if term.isdigit():
+        return or_(User.phone.like(f"{term}%"), User.account_number.like(f"{term}%"), contains)
+    return contains
+
+
+def search_query(term: str, before_id: int | None = None) -> Select:
+    """select(User) khớp term (rỗng = tất cả), id < before_id, mới nhất trước — caller thêm cột / LIMIT."""
+    query = select(User)
+    if term:
+        query = query.where(search_filter(term))
+    if before_id is not None:
+        query = query.where(User.id < before_id)
+    return query.order_by(User.id.desc())
+
+
+async def count_users(db: AsyncSession, term: str, mode: str = "auto") -> tuple[int | None, bool]:
+    """(tổng, có phải ước lượng) — xem pagination.count_total."""
+    query = select(User.id)
+    if term:
+        query = query.where(search_filter(term))
+    return await count_total(db, query, mode)
@@ -0,0 +1,40 @@
+from common import admission
+from common.admission import AdmissionController, QueueLimit, QueueMonitor
+
+
+def _controller(monkeypatch, reject_no_consumers: bool):
+    monkeypatch.setattr(admission, "REJECT_NO_CONSUMERS", reject_no_consumers)
+    monitor = QueueMonitor(connection=None, queue_names=("test.requests",))
+    return monitor, AdmissionController(monitor, limits={"test.requests": QueueLimit(max_depth=100, max_inflight=0)})
+
+
+def test_zero_consumers_admitted_by_default(monkeypatch):
+    monitor, controller = _controller(monkeypatch, False)
+    for _ in range(admission.NO_CONSUMERS_SAMPLES + 1):
+        monitor._record("test.requests", 5, 0)
+    assert controller.try_admit("test.requests") is None
+
+
+def test_zero_consumers_rejected_only_after_consecutive_samples(monkeypatch):
+    monitor, controller = _controller(monkeypatch, True)
+    for _ in range(admission.NO_CONSUMERS_SAMPLES - 1):
+        monitor._record("test.requests", 5, 0)
+        assert controller.try_admit("test.requests") is None
+        controller.release("test.requests")
+    monitor._record("test.requests", 5, 0)
+    assert controller.try_admit("test.requests").reason == "no_consumers"
+
+
+def test_consumer_back_resets_streak(monkeypatch):
+    monitor, controller = _controller(monkeypatch, True)
+    for _ in range(admission.NO_CONSUMERS_SAMPLES):
+        monitor._record("test.requests", 5, 0)
+    monitor._record("test.requests", 5, 1)
+    monitor._record("test.requests", 5, 0)
+    assert controller.try_admit("test.requests") is None
+
+
+def test_queue_depth_rejected(monkeypatch):
+    monitor, controller = _controller(monkeypatch, False)
+    monitor._record("test.requests", 100, 2)
+    assert controller.try_admit("test.requests").reason == "queue_depth"
@@ -0,0 +1,50 @@
+import pytest
+
+from common import rabbitmq_utils
+from common.rabbitmq_utils import JsonCodec, codec_for, get_codec
+
+MESSAGE = {
+    "action": "transfer",
+    "path": "/api/transfer/transfer",
+    "payload": {"amount": 1500, "to_account_number": "0123456789", "note": "chuyển tiền"},
+    "headers": {"x-session": "abc", "x-deadline": 1760000000.5},
+    "flags": [True, False, None],
+}
+
+
+@pytest.mark.parametrize("name", ["json", "orjson", "msgpack"])
+def test_codec_round_trip(name):
+    if name == "orjson":
+        pytest.importorskip("orjson")
+    if name == "msgpack":
+        pytest.importorskip("msgpack")
+    codec = get_codec(name)
+    assert codec.decode(codec.encode(MESSAGE)) == MESSAGE
+    assert codec_for(codec.content_type).decode(codec.encode(MESSAGE)) == MESSAGE
+
+
+def test_json_codecs_share_wire_format():
+    pytest.importorskip("orjson")
+    assert get_codec("orjson").decode(JsonCodec().encode(MESSAGE)) == MESSAGE
+    assert JsonCodec().decode(get_codec("orjson").encode(MESSAGE)) == MESSAGE
+
+
+def test_missing_content_type_defaults_to_json():
+    assert codec_for(None).content_type == JsonCodec.content_type
+
+
+def test_unknown_content_type_raises():
+    with pytest.raises(ValueError):
+        codec_for("application/x-unknown")
+
+
+class _Message:
+    def __init__(self, body: bytes, content_type: str | None):
+        self.body = body
+        self.content_type = content_type
+
+
+def test_decode_message_rejects_non_object_body():
+    assert rabbitmq_utils.decode_message(_Message(JsonCodec().encode(MESSAGE), "application/json")) == MESSAGE
+    with pytest.raises(ValueError):
+        rabbitmq_utils.decode_message(_Message(b"[1, 2]", "application/json"))
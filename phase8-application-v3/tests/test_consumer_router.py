@@ -0,0 +1,53 @@
+import pytest
+
+from common.consumer import Router
+
+
+def _router():
+    router = Router(prefix="/api/account/")
+
+    @router.route("me")
+    async def handle_me(ctx):
+        pass
+
+    @router.route("admin/users/{user_id}")
+    async def handle_user(ctx):
+        pass
+
+    @router.action("health")
+    async def handle_health(ctx):
+        pass
+
+    @router.default
+    async def handle_default(ctx):
+        pass
+
+    return router
+
+
+def test_static_route():
+    name, _, params = _router().resolve("/api/account/me", "me")
+    assert (name, params) == ("handle_me", {})
+
+
+def test_template_route_parses_int_params():
+    name, _, params = _router().resolve("/api/account/admin/users/42", "42")
+    assert (name, params) == ("handle_user", {"user_id": 42})
+
+
+def test_non_numeric_segment_does_not_match_template():
+    assert _router().resolve("/api/account/admin/users/abc", "abc")[0] == "handle_default"
+
+
+@pytest.mark.parametrize("path", ["/api/accountme", "/api/accounts/me", "/api/other/me"])
+def test_prefix_matches_whole_segments_only(path):
+    assert _router().resolve(path, "")[0] == "handle_default"
+
+
+def test_action_fallback_when_no_path_matches():
+    assert _router().resolve("", "health")[0] == "handle_health"
+
+
+def test_no_default_returns_none():
+    router = Router(prefix="/api/auth")
+    assert router.resolve("/api/auth/login", "login") is None
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+
+from common.pagination import MAX_LIMIT, decode_cursor, decode_id_cursor, encode_cursor, encode_id_cursor, parse_limit
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 3, 1, 12, 30, 45, 123456)
+    cursor = encode_cursor(created_at, 987)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, 987)
+
+
+def test_id_cursor_round_trip():
+    assert decode_id_cursor(encode_id_cursor(123456789)) == 123456789
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64 !", encode_id_cursor(5), "MjAyNi0wMS0wMXxhYmM"])
+def test_invalid_cursor_raises(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_invalid_id_cursor_raises():
+    with pytest.raises(ValueError):
+        decode_id_cursor(encode_cursor(datetime(2026, 1, 1), 1))
+
+
+@pytest.mark.parametrize("value,expected", [(None, 20), ("", 20), ("5", 5), ("0", 1), ("-3", 1), ("1000", MAX_LIMIT)])
+def test_parse_limit_clamps(value, expected):
+    assert parse_limit(value) == expected
+
+
+def test_parse_limit_rejects_non_numeric():
+    with pytest.raises(ValueError):
+        parse_limit("ten")
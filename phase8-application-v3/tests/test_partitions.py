@@ -0,0 +1,43 @@
+from datetime import date, datetime
+
+import pytest
+
+from common.partitions import _BOUND_RE, _parse_bound, _parse_ts, add_months, is_missing_partition, partition_name
+
+
+@pytest.mark.parametrize("month,n,expected", [
+    (date(2026, 1, 1), 1, date(2026, 2, 1)),
+    (date(2026, 11, 1), 3, date(2027, 2, 1)),
+    (date(2026, 1, 1), -1, date(2025, 12, 1)),
+    (date(2026, 3, 1), -15, date(2024, 12, 1)),
+])
+def test_add_months(month, n, expected):
+    assert add_months(month, n) == expected
+
+
+def test_partition_name():
+    assert partition_name("transfers", date(2026, 1, 1)) == "transfers_y2026m01"
+
+
+@pytest.mark.parametrize("bound,expected", [
+    ("FOR VALUES FROM ('2026-01-01 00:00:00') TO ('2026-02-01 00:00:00')", (datetime(2026, 1, 1), datetime(2026, 2, 1))),
+    ("FOR VALUES FROM (MINVALUE) TO ('2026-02-01 00:00:00')", (None, datetime(2026, 2, 1))),
+    ("FOR VALUES FROM ('2026-01-01 00:00:00') TO (MAXVALUE)", (datetime(2026, 1, 1), None)),
+])
+def test_parse_partition_bound(bound, expected):
+    m = _BOUND_RE.search(bound)
+    assert (_parse_bound(m.group(1)), _parse_bound(m.group(2))) == expected
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("2026-01-01", datetime(2026, 1, 1)),
+    ("2026-01-01T07:00:00Z", datetime(2026, 1, 1, 7)),
+    ("2026-01-01T07:00:00+07:00", datetime(2026, 1, 1)),
+])
+def test_parse_query_timestamp_to_naive_utc(value, expected):
+    assert _parse_ts(value) == expected
+
+
+def test_is_missing_partition():
+    assert is_missing_partition(Exception('no partition of relation "notifications" found for row'))
+    assert not is_missing_partition(Exception("duplicate key value violates unique constraint"))
@@ -0,0 +1,45 @@
+import asyncio
+import importlib.util
+import pathlib
+
+import pytest
+
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def _load_producer():
+    spec = importlib.util.spec_from_file_location("phase8_producer_main", str(ROOT / "producer" / "main.py"))
+    assert spec and spec.loader
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)  # type: ignore[attr-defined]
+    return mod
+
+
+def test_leader_cancel_hands_off_to_shared_waiters():
+    producer = _load_producer()
+    key = ("/api/account/balance", (), "session")
+    calls = []
+
+    async def publish():
+        calls.append(asyncio.current_task())
+        if len(calls) == 1:
+            await asyncio.sleep(10)  # leader đầu tiên bị huỷ trong lúc chờ reply
+        await asyncio.sleep(0)
+        return {"status": 200, "body": {"balance": 100}}
+
+    async def scenario():
+        leader = asyncio.create_task(producer._singleflight(key, publish))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(producer._singleflight(key, publish)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results
+
+    results = asyncio.run(scenario())
+    assert results == [{"status": 200, "body": {"balance": 100}}] * 3
+    assert len(calls) == 2  # 1 follower thành leader mới, 2 follower còn lại dùng chung kết quả
+    assert producer._inflight_reads == {}
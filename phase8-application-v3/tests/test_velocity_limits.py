@@ -0,0 +1,20 @@
+import pytest
+
+from common.redis_utils import VelocityRule, parse_velocity_limits
+
+
+def test_parse_rules():
+    rules = parse_velocity_limits("sender:count:60:30, receiver:amount:86400:50000000")
+    assert rules == [VelocityRule("sender", "count", 60, 30), VelocityRule("receiver", "amount", 86400, 50000000)]
+    assert rules[0].name == "sender_count_60s"
+
+
+@pytest.mark.parametrize("spec", ["", " ", ",,"])
+def test_empty_spec_disables(spec):
+    assert parse_velocity_limits(spec) == []
+
+
+@pytest.mark.parametrize("spec", ["user:count:60:30", "sender:volume:60:30", "sender:count:60", "sender:count:sixty:30"])
+def test_invalid_rule_raises(spec):
+    with pytest.raises(ValueError):
+        parse_velocity_limits(spec)
@@ -19,6 +19,7 @@ import random
 import sys
 import threading
 import time
+import uuid
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
@@ -82,15 +83,17 @@ def get_balance(base_url: str, session: str, verify: bool = True) -> int | None:
 
 
 def transfer(base_url: str, session: str, to_account: str, amount: int, verify: bool = True, http_session: requests.Session | None = None, retries: int = 5) -> dict:
-    """Thực hiện chuyển khoản. Trả về dict {ok, detail}. Retry khi Connection reset."""
+    """Thực hiện chuyển khoản. Trả về dict {ok, detail}. Retry khi Connection reset.
+    Mọi lần retry dùng chung 1 Idempotency-Key → server không chuyển tiền 2 lần (Phase 8)."""
     url = f"{base_url}/api/transfer/transfer"
     s = http_session or requests.Session()
+    idempotency_key = uuid.uuid4().hex
     for attempt in range(retries):
         try:
             r = s.post(
                 url,
                 json={"to_account_number": to_account, "amount": amount},
-                headers={"X-Session": session},
+                headers={"X-Session": session, "Idempotency-Key": idempotency_key},
                 timeout=60,
                 verify=verify,
             )
@@ -117,14 +120,21 @@ def fetch_users_from_db(base_url: str, admin_secret: str, verify: bool = True) -
     """Lấy danh sách users từ admin API."""
     users = []
     page = 1
+    cursor = None
     while True:
-        url = f"{base_url}/api/account/admin/users?page={page}&size=100"
+        # Phase 8 phân trang keyset (next_cursor); các phase trước dùng page/pages
+        url = f"{base_url}/api/account/admin/users?size=100&" + (f"cursor={cursor}" if cursor else f"page={page}")
         try:
             r = requests.get(url, headers={"X-Admin-Secret": admin_secret}, timeout=10, verify=verify)
             if r.status_code != 200:
                 break
             data = r.json()
             users.extend(data.get("users", []))
+            if "next_cursor" in data:
+                cursor = data["next_cursor"]
+                if not cursor:
+                    break
+                continue
             if page >= data.get("pages", 1):
                 break
             page += 1